@@ -3,7 +3,7 @@ from django.contrib.admin import ModelAdmin
 from import_export.admin import ImportExportActionModelAdmin
 from mptt.admin import DraggableMPTTAdmin
 
-from apps.models import Category, Product, ProductImage, Tag, SiteSettings
+from apps.models import Category, Product, ProductImage, Tag, SiteSettings, OutgoingEmail
 
 
 @register(Category)
@@ -37,3 +37,9 @@ class TagModelAdmin(ImportExportActionModelAdmin):
 class SiteSettingsModelAdmin(ModelAdmin):
     pass
 
+
+@register(OutgoingEmail)
+class OutgoingEmailModelAdmin(ModelAdmin):
+    list_display = ('id', 'to', 'subject', 'status', 'attempts', 'send_after', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('to',)
@@ -0,0 +1,231 @@
+from threading import Lock
+from time import monotonic, time_ns
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from apps.db.stats import flush_counters
+from apps.metrics import observe_cache_lookup
+from apps.models import Category, CartItem, Favorite, User
+
+# in concrete field order: Model.from_db maps the row values positionally
+CATEGORY_TREE_FIELDS = 'id', 'name', 'slug', 'parent_id', 'lft', 'rght', 'tree_id', 'level'
+CATEGORY_TREE_VERSION_KEY = 'category_tree:version'
+# the product counts change with every product write, so they expire instead of bumping the tree version
+CATEGORY_COUNTS_KEY = 'category_tree:counts'
+TAGS_VERSION_KEY = 'tags:version'
+CATEGORY_SIDEBAR_PLACEHOLDER = '<!-- category sidebar -->'
+CACHE_STATS_NAMES = 'product_page', 'fragment:product_summary', 'fragment:product_details'
+
+_category_tree = (None, ())
+_lookup_counts = {}
+_lookup_counts_lock = Lock()
+_lookup_counts_flushed = monotonic()
+
+
+def get_versions(*keys):
+    versions = cache.get_many(keys)
+    for key in keys:
+        if versions.get(key) is None:
+            # never restart from 1: processes may still hold rows for an evicted version
+            cache.add(key, time_ns(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(*keys):
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time_ns(), None)
+
+
+def get_category_tree_version():
+    return get_versions(CATEGORY_TREE_VERSION_KEY)[0]
+
+
+def bump_category_tree_version():
+    bump_versions(CATEGORY_TREE_VERSION_KEY)
+
+
+def product_version_key(product_id):
+    return f'product:{product_id}:version'
+
+
+def get_product_page_version(product_id):
+    # everything the cached detail page holds: the product and its images/reviews and the tag list;
+    # the sidebar is spliced in on every response, so category changes never drop a product page
+    return '.'.join(map(str, get_versions(product_version_key(product_id), TAGS_VERSION_KEY)))
+
+
+def bump_product_versions(product_ids):
+    bump_versions(*(product_version_key(product_id) for product_id in product_ids))
+
+
+def bump_tags_version():
+    bump_versions(TAGS_VERSION_KEY)
+
+
+def cache_stats_key(name, kind):
+    return f'cache_stats:{name}:{kind}'
+
+
+def record_cache_lookup(name, hit):
+    # summed in process and written to the cache at most every DB_QUERY_STATS_FLUSH seconds, like the database
+    # stats: a lookup must not cost more cache round trips than it saves
+    global _lookup_counts, _lookup_counts_flushed
+
+    observe_cache_lookup(name, hit)
+    if not settings.CACHE_STATS:
+        return
+    key = cache_stats_key(name, 'hits' if hit else 'misses')
+    with _lookup_counts_lock:
+        _lookup_counts[key] = _lookup_counts.get(key, 0) + 1
+        if monotonic() - _lookup_counts_flushed < settings.DB_QUERY_STATS_FLUSH:
+            return
+        pending, _lookup_counts, _lookup_counts_flushed = _lookup_counts, {}, monotonic()
+    flush_counters(pending)
+
+
+def get_cache_stats(names):
+    keys = {(name, kind): cache_stats_key(name, kind) for name in names for kind in ('hits', 'misses')}
+    values = cache.get_many(keys.values())
+    return {name: (values.get(keys[name, 'hits'], 0), values.get(keys[name, 'misses'], 0)) for name in names}
+
+
+def reset_cache_stats(names):
+    cache.delete_many([cache_stats_key(name, kind) for name in names for kind in ('hits', 'misses')])
+
+
+def _category_counts_query():
+    return Category.objects.using(DEFAULT_DB_ALIAS).values_list('id', 'product_count')
+
+
+def get_category_counts():
+    counts = cache.get(CATEGORY_COUNTS_KEY)
+    if counts is None:
+        counts = dict(_category_counts_query())
+        cache.set(CATEGORY_COUNTS_KEY, counts, settings.CATEGORY_COUNTS_TIMEOUT)
+    return counts
+
+
+async def aget_category_counts():
+    counts = await cache.aget(CATEGORY_COUNTS_KEY)
+    if counts is None:
+        counts = {pk: count async for pk, count in _category_counts_query()}
+        await cache.aset(CATEGORY_COUNTS_KEY, counts, settings.CATEGORY_COUNTS_TIMEOUT)
+    return counts
+
+
+def invalidate_category_counts():
+    cache.delete(CATEGORY_COUNTS_KEY)
+
+
+def get_category_tree(version=None):
+    global _category_tree
+
+    version = version or get_category_tree_version()
+    cached_version, rows = _category_tree
+    if cached_version != version:
+        # kept by the process under this version, so never from a replica that has not caught up with it
+        rows = tuple(Category.objects.using(DEFAULT_DB_ALIAS).values_list(*CATEGORY_TREE_FIELDS))
+        _category_tree = version, rows
+    return _tree_nodes(rows, get_category_counts())
+
+
+async def aget_category_tree():
+    global _category_tree
+
+    version = await sync_to_async(get_category_tree_version)()
+    cached_version, rows = _category_tree
+    if cached_version != version:
+        rows = tuple([row async for row in Category.objects.using(DEFAULT_DB_ALIAS).values_list(
+            *CATEGORY_TREE_FIELDS)])
+        _category_tree = version, rows
+    return _tree_nodes(rows, await aget_category_counts())
+
+
+def _tree_nodes(rows, counts):
+    # fresh instances per call: recursetree caches children on the nodes it walks
+    nodes = [Category.from_db('default', CATEGORY_TREE_FIELDS, row) for row in rows]
+    for node in nodes:
+        node.product_count = counts.get(node.pk, 0)
+    return nodes
+
+
+def get_category_subtree(slug, tree=None):
+    # (category, ids of it and every descendant) from the cached tree, no query
+    if tree is None:
+        tree = get_category_tree()
+    category = next((node for node in tree if node.slug == slug), None)
+    if category is None:
+        return None, []
+    return category, [node.pk for node in tree if node.tree_id == category.tree_id
+                      and category.lft <= node.lft and node.rght <= category.rght]
+
+
+def product_page_key(product_id, version):
+    return f'product_page:{product_id}:{version}'
+
+
+def get_category_sidebar():
+    version = get_category_tree_version()
+    key = f'category_sidebar:{version}'
+    html = cache.get(key)
+    if html is None:
+        html = render_to_string('apps/parts/_sidebar.html', {'categories': get_category_tree(version)})
+        # it shows the product counts, so it lives no longer than they do
+        cache.set(key, html, settings.CATEGORY_COUNTS_TIMEOUT)
+    return mark_safe(html)
+
+
+def insert_category_sidebar(content):
+    return content.replace(CATEGORY_SIDEBAR_PLACEHOLDER.encode(), get_category_sidebar().encode(), 1)
+
+
+def header_counts_key(user_id):
+    return f'header_counts:{user_id}'
+
+
+def _header_counts_query(user_id):
+    return User.objects.using(DEFAULT_DB_ALIAS).filter(pk=user_id).values(
+        cart_count=_count_for_user(CartItem),
+        favourite_count=_count_for_user(Favorite),
+    )
+
+
+def get_header_counts(user_id):
+    timeout = settings.HEADER_COUNTS_CACHE_TIMEOUT
+    counts = cache.get(header_counts_key(user_id)) if timeout else None
+    if counts is None:
+        counts = _header_counts_query(user_id).first() or {'cart_count': 0, 'favourite_count': 0}
+        if timeout:
+            cache.set(header_counts_key(user_id), counts, timeout)
+    return counts
+
+
+async def aget_header_counts(user_id):
+    timeout = settings.HEADER_COUNTS_CACHE_TIMEOUT
+    counts = await cache.aget(header_counts_key(user_id)) if timeout else None
+    if counts is None:
+        counts = await _header_counts_query(user_id).afirst() or {'cart_count': 0, 'favourite_count': 0}
+        if timeout:
+            await cache.aset(header_counts_key(user_id), counts, timeout)
+    return counts
+
+
+def invalidate_header_counts(user_id):
+    if settings.HEADER_COUNTS_CACHE_TIMEOUT:
+        cache.delete(header_counts_key(user_id))
+
+
+def _count_for_user(model):
+    counts = model.objects.filter(user=OuterRef('pk')).order_by().values('user').annotate(count=Count('pk'))
+    return Coalesce(Subquery(counts.values('count')), 0)
@@ -0,0 +1,139 @@
+from django.db import connection, transaction
+from django.db.models import Sum, F, Value
+from django.db.models.functions import Coalesce
+
+from apps.models import CartItem, CartSummary
+
+CART_LINE_SUBTOTAL = F('quantity') * F('product__effective_price')
+
+
+def line_subtotal(product, quantity):
+    return quantity * product.effective_price
+
+
+def cart_totals(queryset):
+    return queryset.aggregate(
+        item_count=Coalesce(Sum('quantity'), Value(0)),
+        subtotal=Coalesce(Sum(CART_LINE_SUBTOTAL), Value(0)),
+        shipping=Coalesce(Sum('product__shipping_cost'), Value(0)),
+    )
+
+
+def rebuild_cart_summary(user_id):
+    totals = cart_totals(CartItem.objects.filter(user_id=user_id))
+    # an upsert: two first adds for one user can both get here
+    summary = CartSummary(user_id=user_id, total=totals['subtotal'] + totals['shipping'], **totals)
+    _upsert_summaries([summary])
+    return summary
+
+
+def get_cart_summary(user):
+    return CartSummary.objects.filter(user=user).first() or rebuild_cart_summary(user.pk)
+
+
+def update_cart_summary(user_id, product, old_quantity, new_quantity):
+    update_cart_summary_many(user_id, [(product, old_quantity, new_quantity)])
+
+
+def update_cart_summary_many(user_id, changes):
+    item_count = subtotal = shipping = 0
+    for product, old_quantity, new_quantity in changes:
+        item_count += new_quantity - old_quantity
+        subtotal += line_subtotal(product, new_quantity) - line_subtotal(product, old_quantity)
+        shipping += product.shipping_cost * ((new_quantity > 0) - (old_quantity > 0))
+
+    updated = CartSummary.objects.filter(user_id=user_id).update(
+        item_count=F('item_count') + item_count,
+        subtotal=F('subtotal') + subtotal,
+        shipping=F('shipping') + shipping,
+        total=F('total') + subtotal + shipping,
+    )
+    if not updated:
+        rebuild_cart_summary(user_id)
+
+
+def set_cart_quantity(user_id, item_id, quantity):
+    # the row lock makes a concurrent update wait and then read our quantity as its old one
+    with transaction.atomic():
+        item = CartItem.objects.select_for_update(of=('self',)).select_related('product').get(
+            pk=item_id, user_id=user_id)
+        old_quantity, item.quantity = item.quantity, quantity
+        item.save(update_fields=['quantity'])
+        update_cart_summary(user_id, item.product, old_quantity, quantity)
+    return item
+
+
+def remove_from_cart(user_id, item_id):
+    with transaction.atomic():
+        item = CartItem.objects.select_for_update(of=('self',)).select_related('product').filter(
+            pk=item_id, user_id=user_id).first()
+        if item is None:
+            # removed by a concurrent request, which already took it off the summary
+            return None
+        item.delete()
+        update_cart_summary(user_id, item.product, item.quantity, 0)
+    return item
+
+
+def add_to_cart(user_id, product, quantity=1):
+    return add_many_to_cart(user_id, {product: quantity})[product.pk]
+
+
+# one upsert per call: concurrent adds to the same row are serialized by the unique index, never lost
+def add_many_to_cart(user_id, quantities):
+    products = sorted(quantities, key=lambda product: product.pk)  # same lock order for every caller
+    if not products:
+        return {}
+
+    table = connection.ops.quote_name(CartItem._meta.db_table)
+    values = ', '.join(['(%s, %s, %s)'] * len(products))
+    params = [value for product in products for value in (user_id, product.pk, quantities[product])]
+    # the rows and the summary delta commit together, a failure in between would leave the summary off
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (user_id, product_id, quantity) VALUES {values} '
+            f'ON CONFLICT (user_id, product_id) DO UPDATE SET quantity = {table}.quantity + EXCLUDED.quantity '
+            f'RETURNING product_id, quantity',
+            params,
+        )
+        new_quantities = dict(cursor.fetchall())
+
+        update_cart_summary_many(user_id, [
+            (product, new_quantities[product.pk] - quantities[product], new_quantities[product.pk])
+            for product in products
+        ])
+    return new_quantities
+
+
+def rebuild_cart_summaries(user_ids=None, batch_size=1000):
+    items = CartItem.objects.all()
+    summaries = CartSummary.objects.all()
+    if user_ids is not None:
+        items = items.filter(user_id__in=user_ids)
+        summaries = summaries.filter(user_id__in=user_ids)
+
+    rows = items.order_by('user_id').values('user_id').annotate(
+        item_count=Sum('quantity'),
+        subtotal=Sum(CART_LINE_SUBTOTAL),
+        shipping=Sum('product__shipping_cost'),
+    )
+    batch, rebuilt = [], 0
+    for row in rows.iterator(chunk_size=batch_size):
+        batch.append(CartSummary(total=row['subtotal'] + row['shipping'], **row))
+        if len(batch) == batch_size:
+            rebuilt += _upsert_summaries(batch)
+            batch = []
+    rebuilt += _upsert_summaries(batch)
+
+    emptied = summaries.exclude(user_id__in=items.values('user_id')).exclude(item_count=0).update(
+        item_count=0, subtotal=0, shipping=0, total=0
+    )
+    return rebuilt, emptied
+
+
+def _upsert_summaries(summaries):
+    CartSummary.objects.bulk_create(
+        summaries, update_conflicts=True, unique_fields=['user'],
+        update_fields=['item_count', 'subtotal', 'shipping', 'total'],
+    )
+    return len(summaries)
@@ -0,0 +1,26 @@
+from django.utils.functional import cached_property
+
+from apps.cache import get_header_counts
+
+
+class HeaderCounts:
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def counts(self):
+        if not self.user.is_authenticated:
+            return {'cart_count': 0, 'favourite_count': 0}
+        return get_header_counts(self.user.pk)
+
+    @property
+    def cart_count(self):
+        return self.counts['cart_count']
+
+    @property
+    def favourite_count(self):
+        return self.counts['favourite_count']
+
+
+def header_counts(request):
+    return {'header_counts': HeaderCounts(request.user)}
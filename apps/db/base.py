@@ -0,0 +1,24 @@
+from time import perf_counter
+
+from django.db.backends.postgresql import base
+
+from apps.db.stats import record_close, record_connect, track_query
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # the stock postgresql backend, counting and timing the connections it opens and the queries of each request
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.execute_wrappers.append(track_query)
+
+    def get_new_connection(self, conn_params):
+        started = perf_counter()
+        connection = super().get_new_connection(conn_params)
+        record_connect(self.alias, perf_counter() - started)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            record_close(self.alias)
+        return super()._close()
@@ -0,0 +1,52 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from random import choice
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+_read_alias = ContextVar('read_alias', default=None)
+
+
+@contextmanager
+def read_from_replica():
+    # one replica for the whole block, so a page never mixes two replication positions
+    token = _read_alias.set(choice(settings.REPLICA_DATABASES) if settings.REPLICA_DATABASES else None)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+@contextmanager
+def read_from_default():
+    # for reads that fill a version-keyed cache: a lagging replica would store old rows under the new version
+    token = _read_alias.set(None)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+class ReplicaRouter:
+    # writes always go to default; reads only go to a replica inside read_from_replica()
+
+    def db_for_read(self, model, **hints):
+        # a stale session row would sign the user out right after logging in
+        if model._meta.app_label == 'sessions':
+            return DEFAULT_DB_ALIAS
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, *settings.REPLICA_DATABASES}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.REPLICA_DATABASES:
+            return False
+        return None
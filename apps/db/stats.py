@@ -0,0 +1,142 @@
+import logging
+import re
+from contextvars import ContextVar
+from threading import Lock
+from time import monotonic, perf_counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+POOL_STATS_FIELDS = 'connects', 'closes', 'connect_us'
+ALIAS_STATS_FIELDS = 'queries', 'time_us', 'writes'
+WRITE_SQL = re.compile(r'\s*(INSERT|UPDATE|DELETE)\b', re.IGNORECASE)
+
+logger = logging.getLogger(__name__)
+
+
+def pool_stats_key(role, alias, field):
+    return f'db_pool:{role}:{alias}:{field}'
+
+
+def _incr(key, delta=1):
+    if not cache.add(key, delta, None):
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            cache.add(key, delta, None)
+
+
+_pool_counts = {}
+_pool_counts_lock = Lock()
+_pool_counts_flushed = monotonic()
+
+
+def flush_counters(counters):
+    # key -> delta; the stats are best effort, a cache outage must not fail the connect or request that flushes
+    try:
+        for key, delta in counters.items():
+            _incr(key, delta)
+    except Exception:
+        logger.warning('Could not write the stats counters to the cache', exc_info=True)
+
+
+def _count_connection(alias, connects=0, closes=0, seconds=0.0):
+    # summed in process and written to the cache at most every DB_QUERY_STATS_FLUSH seconds, like the query counts
+    global _pool_counts, _pool_counts_flushed
+
+    if not settings.DB_POOL_STATS:
+        return
+    with _pool_counts_lock:
+        counts = _pool_counts.setdefault(alias, [0, 0, 0.0])
+        counts[0] += connects
+        counts[1] += closes
+        counts[2] += seconds
+        if monotonic() - _pool_counts_flushed < settings.DB_QUERY_STATS_FLUSH:
+            return
+        pending, _pool_counts, _pool_counts_flushed = _pool_counts, {}, monotonic()
+    role = settings.DB_ROLE
+    flush_counters({
+        pool_stats_key(role, alias, field): value
+        for alias, (connects, closes, seconds) in pending.items()
+        for field, value in (('connects', connects), ('closes', closes), ('connect_us', round(seconds * 1_000_000)))
+    })
+
+
+def record_connect(alias, seconds):
+    _count_connection(alias, connects=1, seconds=seconds)
+
+
+def record_close(alias):
+    _count_connection(alias, closes=1)
+
+
+def get_pool_stats(roles, alias='default'):
+    keys = {(role, field): pool_stats_key(role, alias, field) for role in roles for field in POOL_STATS_FIELDS}
+    values = cache.get_many(keys.values())
+    return {role: {field: values.get(keys[role, field], 0) for field in POOL_STATS_FIELDS} for role in roles}
+
+
+def reset_pool_stats(roles, alias='default'):
+    cache.delete_many([pool_stats_key(role, alias, field) for role in roles for field in POOL_STATS_FIELDS])
+
+
+# per request: alias -> [queries, seconds, writes], filled by track_query on every connection of apps.db
+request_queries = ContextVar('request_queries', default=None)
+# per sampled request: sql -> executions, for the N+1 check in apps.metrics
+request_sql = ContextVar('request_sql', default=None)
+_alias_totals = {}
+_alias_totals_lock = Lock()
+_alias_totals_flushed = monotonic()
+
+
+def track_query(execute, sql, params, many, context):
+    queries = request_queries.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+    started = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        totals = queries.setdefault(context['connection'].alias, [0, 0.0, 0])
+        totals[0] += 1
+        totals[1] += perf_counter() - started
+        totals[2] += WRITE_SQL.match(sql) is not None
+        sql_counts = request_sql.get()
+        if sql_counts is not None:
+            sql_counts[sql] += 1
+
+
+def alias_stats_key(alias, field):
+    return f'db_alias:{alias}:{field}'
+
+
+def record_alias_queries(queries):
+    # summed in process and written to the cache at most every DB_QUERY_STATS_FLUSH seconds
+    global _alias_totals, _alias_totals_flushed
+
+    if not settings.DB_POOL_STATS:
+        return
+    with _alias_totals_lock:
+        for alias, (count, seconds, writes) in queries.items():
+            totals = _alias_totals.setdefault(alias, [0, 0.0, 0])
+            totals[0] += count
+            totals[1] += seconds
+            totals[2] += writes
+        if monotonic() - _alias_totals_flushed < settings.DB_QUERY_STATS_FLUSH:
+            return
+        pending, _alias_totals, _alias_totals_flushed = _alias_totals, {}, monotonic()
+    flush_counters({
+        alias_stats_key(alias, field): value
+        for alias, (count, seconds, writes) in pending.items()
+        for field, value in (('queries', count), ('time_us', round(seconds * 1_000_000)), ('writes', writes))
+    })
+
+
+def get_alias_stats(aliases):
+    keys = {(alias, field): alias_stats_key(alias, field) for alias in aliases for field in ALIAS_STATS_FIELDS}
+    values = cache.get_many(keys.values())
+    return {alias: {field: values.get(keys[alias, field], 0) for field in ALIAS_STATS_FIELDS} for alias in aliases}
+
+
+def reset_alias_stats(aliases):
+    cache.delete_many([alias_stats_key(alias, field) for alias in aliases for field in ALIAS_STATS_FIELDS])
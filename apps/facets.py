@@ -0,0 +1,173 @@
+import json
+from collections import Counter, defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Q, Sum
+
+from apps.cache import invalidate_category_counts
+from apps.models import SpecFacetCount, Product, Category
+
+SPEC_PARAM_PREFIX = 'spec.'
+
+_KEY_LENGTH = SpecFacetCount._meta.get_field('key').max_length
+_VALUE_LENGTH = SpecFacetCount._meta.get_field('value').max_length
+
+
+def facet_value(value):
+    # same text Postgres gives for `value #>> '{}'`, so signals and the SQL rebuild agree
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+def facet_pairs(specifications):
+    if not isinstance(specifications, dict):
+        return set()
+    return {
+        (key[:_KEY_LENGTH], facet_value(value)[:_VALUE_LENGTH])
+        for key, value in specifications.items()
+        if isinstance(value, (str, int, float, bool))
+    }
+
+
+def update_facet_counts(old=None, new=None):
+    # old and new are (category_id, specifications) before and after a product write
+    deltas = Counter()
+    if old is not None:
+        deltas.subtract({(old[0], *pair): 1 for pair in facet_pairs(old[1])})
+    if new is not None:
+        deltas.update({(new[0], *pair): 1 for pair in facet_pairs(new[1])})
+
+    added = [(*facet, delta) for facet, delta in deltas.items() if delta > 0]
+    removed = [(*facet, -delta) for facet, delta in deltas.items() if delta < 0]
+    table = connection.ops.quote_name(SpecFacetCount._meta.db_table)
+    with connection.cursor() as cursor:
+        if added:
+            cursor.execute(
+                f'INSERT INTO {table} (category_id, key, value, count) VALUES {", ".join(["(%s, %s, %s, %s)"] * len(added))} '
+                f'ON CONFLICT (category_id, key, value) DO UPDATE SET count = {table}.count + EXCLUDED.count',
+                [value for row in added for value in row],
+            )
+        if removed:
+            # never inserts: the category may be going away in the same cascade
+            cursor.execute(
+                f'UPDATE {table} AS facet SET count = facet.count - changes.count '
+                f'FROM (VALUES {", ".join(["(%s::integer, %s::text, %s::text, %s::integer)"] * len(removed))}) '
+                f'AS changes (category_id, key, value, count) '
+                f'WHERE facet.category_id = changes.category_id AND facet.key = changes.key '
+                f'AND facet.value = changes.value',
+                [value for row in removed for value in row],
+            )
+
+
+def rebuild_facet_counts():
+    table = connection.ops.quote_name(SpecFacetCount._meta.db_table)
+    products = connection.ops.quote_name(Product._meta.db_table)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table}')
+        cursor.execute(
+            f'INSERT INTO {table} (category_id, key, value, count) '
+            f'SELECT category_id, left(spec.key, %s), left(spec.value #>> %s, %s), count(*) '
+            f'FROM {products}, jsonb_each(CASE WHEN jsonb_typeof(specifications) = %s '
+            f"THEN specifications ELSE '{{}}'::jsonb END) AS spec "
+            f'WHERE jsonb_typeof(spec.value) IN (%s, %s, %s) GROUP BY 1, 2, 3',
+            [_KEY_LENGTH, '{}', _VALUE_LENGTH, 'object', 'string', 'number', 'boolean'],
+        )
+        return cursor.rowcount
+
+
+def spec_facet_rows(category_ids=None):
+    facets = SpecFacetCount.objects.all()
+    if category_ids is not None:
+        facets = facets.filter(category_id__in=category_ids)
+    return facets.values('key', 'value').annotate(total=Sum('count')).filter(total__gt=0).order_by('key', '-total')
+
+
+def group_spec_facets(rows, values_per_key=10):
+    grouped = defaultdict(list)
+    for row in rows:
+        if len(grouped[row['key']]) < values_per_key:
+            grouped[row['key']].append((row['value'], row['total']))
+    return dict(grouped)
+
+
+def spec_facets(category_ids=None, values_per_key=10):
+    return group_spec_facets(spec_facet_rows(category_ids), values_per_key)
+
+
+async def aspec_facets(category_ids=None, values_per_key=10):
+    return group_spec_facets([row async for row in spec_facet_rows(category_ids)], values_per_key)
+
+
+def parse_spec_filters(params):
+    filters = {}
+    for name in params:
+        if name.startswith(SPEC_PARAM_PREFIX) and params.getlist(name):
+            filters[name[len(SPEC_PARAM_PREFIX):]] = [value for value in params.getlist(name) if value]
+    return {key: values for key, values in filters.items() if values}
+
+
+def spec_lookup(key, values):
+    # any of the values for one key; each value may be stored as a JSON string or as a number/boolean
+    lookup = Q()
+    for value in values:
+        lookup |= Q(specifications__contains={key: value})
+        try:
+            parsed = json.loads(value)
+        except ValueError:
+            continue
+        if isinstance(parsed, (int, float, bool)):
+            lookup |= Q(specifications__contains={key: parsed})
+    return lookup
+
+
+def filter_products(queryset, category=None, price_min=None, price_max=None, specs=None):
+    if category is not None:
+        # the whole subtree in one range join, no recursive walk over the children
+        queryset = queryset.filter(category__tree_id=category.tree_id, category__lft__gte=category.lft,
+                                   category__rght__lte=category.rght)
+    if price_min is not None:
+        queryset = queryset.filter(effective_price__gte=price_min)
+    if price_max is not None:
+        queryset = queryset.filter(effective_price__lte=price_max)
+    for key, values in (specs or {}).items():
+        queryset = queryset.filter(spec_lookup(key, values))
+    return queryset
+
+
+def update_category_counts(changes):
+    # changes is [(category_id, delta)]; every ancestor of each category gets the delta, summed per row
+    changes = [(category_id, delta) for category_id, delta in changes if category_id is not None and delta]
+    if not changes:
+        return
+    table = connection.ops.quote_name(Category._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {table} SET product_count = {table}.product_count + totals.delta '
+            f'FROM (SELECT ancestor.id, SUM(changes.delta) AS delta '
+            f'FROM (VALUES {", ".join(["(%s::integer, %s::integer)"] * len(changes))}) AS changes (category_id, delta) '
+            f'JOIN {table} AS leaf ON leaf.id = changes.category_id '
+            f'JOIN {table} AS ancestor ON ancestor.tree_id = leaf.tree_id '
+            f'AND ancestor.lft <= leaf.lft AND ancestor.rght >= leaf.rght '
+            f'GROUP BY ancestor.id) AS totals '
+            f'WHERE {table}.id = totals.id',
+            [value for change in changes for value in change],
+        )
+    # no cache work here: a catalogue import would otherwise reload the counts once per product,
+    # they are picked up when CATEGORY_COUNTS_TIMEOUT runs out
+
+
+def rebuild_category_counts():
+    table = connection.ops.quote_name(Category._meta.db_table)
+    products = connection.ops.quote_name(Product._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {table} SET product_count = totals.count '
+            f'FROM (SELECT ancestor.id, COUNT(product.id) AS count FROM {table} AS ancestor '
+            f'LEFT JOIN {table} AS node ON node.tree_id = ancestor.tree_id '
+            f'AND node.lft BETWEEN ancestor.lft AND ancestor.rght '
+            f'LEFT JOIN {products} AS product ON product.category_id = node.id '
+            f'GROUP BY ancestor.id) AS totals '
+            f'WHERE {table}.id = totals.id',
+        )
+        updated = cursor.rowcount
+    transaction.on_commit(invalidate_category_counts)
+    return updated
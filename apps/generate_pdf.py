@@ -1,109 +1,111 @@
 
-import os.path
+import json
+from hashlib import sha256
+from io import BytesIO
 
-from reportlab.lib import colors
+from django.core.files.base import ContentFile
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
 
-from apps.models import SiteSettings, Order
-from root.settings import MEDIA_ROOT
+from apps.models import SiteSettings, Order, OrderItem
+from apps.pdf_layout import Column, TableLayout
+
+
+def order_pdf_data(order: Order):
+    lines = list(order.order_items.order_by('pk').values_list('product__name', 'quantity', 'discount',
+                                                              'unit_price', 'shipping_cost'))
+    site = SiteSettings.objects.first()
+    return lines, site.tax if site else None
+
+
+def order_lines_by_order(order_ids):
+    lines = {order_id: [] for order_id in order_ids}
+    rows = OrderItem.objects.filter(order_id__in=order_ids).order_by('order_id', 'pk').values_list(
+        'order_id', 'product__name', 'quantity', 'discount', 'unit_price', 'shipping_cost')
+    for order_id, *line in rows:
+        lines[order_id].append(tuple(line))
+    return lines
+
+
+def order_pdf_hash(lines, tax):
+    return sha256(json.dumps([lines, tax]).encode()).hexdigest()
+
+
+def order_pdf_name(order: Order, pdf_hash):
+    return f"order_{order.pk}_{pdf_hash[:16]}.pdf"
+
+
+def is_pdf_current(order: Order, pdf_hash):
+    return bool(order.pdf_file) and order.pdf_hash == pdf_hash and order.pdf_file.storage.exists(order.pdf_file.name)
 
 
 def make_pdf(order: Order):
-    data = order.order_items.values_list('product__name', 'quantity', 'product__discount', 'product__price',
-                                         'product__shipping_cost')
-
-    # Create a canvas object
-    pdf_file_folder = 'order/pdf'
-    if not os.path.exists(f"{MEDIA_ROOT}/{pdf_file_folder}"):
-        os.makedirs(f"{MEDIA_ROOT}/{pdf_file_folder}")
-
-    pdf_file_name = f"{pdf_file_folder}/order_{order.pk}.pdf"
-    c = canvas.Canvas(f"{MEDIA_ROOT}/{pdf_file_name}", pagesize=letter)
-    width, height = letter
-
-    # Insert bold text in the middle of the top
-    title = f"Order Detail #{order.pk}"
-    c.setFont("Helvetica-Bold", 18)
-    title_width = c.stringWidth(title, 'Helvetica-Bold', 18)
-    c.drawString((width - title_width) / 2, height - 40, title)
-
-    c.setFont("Helvetica", 14)
-    # Define the starting position of the table
-    x_offset = 50
-    y_offset = height - 100
-    line_height = 25
-    col_widths = [50, 200, 100, 100, 100]  # Define column widths
-
-    # Draw table headers with background color and borders
-    headers = ['ID', 'Product title', 'Quantity', 'Price', 'Amount']
-    c.setFillColor(colors.lightblue)
-    c.rect(x_offset, y_offset, sum(col_widths), line_height, fill=1)
-    c.setFillColor(colors.black)
-    c.setFont("Helvetica-Bold", 12)
-
-    x = x_offset
-    for i, header in enumerate(headers):
-        c.drawString(x + 5, y_offset + 5, header)
-        c.rect(x, y_offset, col_widths[i], line_height, fill=0)
-        x += col_widths[i]
+    data, tax = order_pdf_data(order)
+    return store_pdf(order, data, tax, order_pdf_hash(data, tax))
+
+
+def store_pdf(order: Order, data, tax, pdf_hash):
+    if is_pdf_current(order, pdf_hash):
+        return order.pdf_file
+
+    # an unchanged order maps to an existing file: never render it twice
+    storage = order.pdf_file.storage
+    name = order.pdf_file.field.generate_filename(order, order_pdf_name(order, pdf_hash))
+    if not storage.exists(name):
+        name = storage.save(name, ContentFile(render_pdf(order.pk, data, tax)[0]))
+
+    previous = order.pdf_file.name
+    order.pdf_file.name = name
+    order.pdf_hash = pdf_hash
+    if previous and previous != name:
+        storage.delete(previous)
+    order.save(update_fields=['pdf_file', 'pdf_hash'])
+    return order.pdf_file
+
+
+def render_pdf(order_pk, data, tax):
+    buffer = BytesIO()
+    pages = write_pdf(buffer, order_pk, data, tax)
+    return buffer.getvalue(), pages
+
+
+def write_pdf(target, order_pk, data, tax):
+    # target is a path or any writable file-like object
+    c = canvas.Canvas(target, pagesize=letter, pageCompression=1)
+    pages = draw_order(c, order_pk, data, tax)
+    c.save()
+    return pages
+
+
+INVOICE_COLUMNS = [
+    Column('ID', 50),
+    Column('Product title', 200),
+    Column('Quantity', 100),
+    Column('Price', 100),
+    Column('Amount', 100),
+]
+
+
+def draw_order(c, order_pk, data, tax):
+    table = TableLayout(c, INVOICE_COLUMNS, title=f"Order Detail #{order_pk}")
 
     total_price = 0
     total_shipping_cost = 0
-    c.setFont("Helvetica", 12)
-    y_offset -= line_height
-
-    # Draw table rows with alternating colors and borders
-    for index, row in enumerate(data, 1):
-        row = list(row)
-        discount = row.pop(2)
-        row_color = colors.whitesmoke if index % 2 == 0 else colors.lightgrey
-        c.setFillColor(row_color)
-        c.rect(x_offset, y_offset, sum(col_widths), line_height, fill=1)
-        c.setFillColor(colors.black)
-
-        product_name, quantity, price, shipping_cost = row
+    for index, (product_name, quantity, discount, price, shipping_cost) in enumerate(data, 1):
         price = price * (100 - discount) // 100
         subtotal = quantity * price
         total_price += subtotal
         total_shipping_cost += shipping_cost
+        table.add_row([index, product_name, quantity, f"{price} $", f"{subtotal} $"])
 
-        row_data = [index, product_name, quantity, f"{price} $", f"{subtotal} $"]
-        x = x_offset
-        for i, item in enumerate(row_data):
-            c.drawString(x + 5, y_offset + 5, str(item))
-            c.rect(x, y_offset, col_widths[i], line_height, fill=0)
-            x += col_widths[i]
-
-        y_offset -= line_height
-
-    y_offset -= line_height
-    text = f'Subtotal: {total_price} $'
-    c.drawString(x_offset, y_offset, text)
-
-    site = SiteSettings.objects.first()
-    if site:
+    lines = [f'Subtotal: {total_price} $']
+    if tax is not None:
         total_price += total_shipping_cost
-        y_offset -= line_height
-        tax_amount = total_price * site.tax // 100
-        text = f'Tax {site.tax}%: {tax_amount} $'
-        c.drawString(x_offset, y_offset, text)
+        tax_amount = total_price * tax // 100
+        lines.append(f'Tax {tax}%: {tax_amount} $')
         total_price += tax_amount
+    lines.append(f'Shipping Cost: {total_shipping_cost} $')
 
-    y_offset -= line_height
-    text = f'Shipping Cost: {total_shipping_cost} $'
-    c.drawString(x_offset, y_offset, text)
-
-    y_offset -= 10
-    c.setLineWidth(1)
-    c.setStrokeColor(colors.grey)
-    c.line(x_offset, y_offset, x_offset + 120, y_offset)
-
-    y_offset -= 18
-    text = f'Total price: {total_price} $'
-    c.drawString(x_offset, y_offset, text)
-
-    # Save the PDF
-    c.save()
-    order.pdf_file = pdf_file_name
-    order.save()
+    table.add_summary(lines, f'Total price: {total_price} $')
+    table.finish()
+    return table.page
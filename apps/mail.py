@@ -0,0 +1,102 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.template import TemplateDoesNotExist
+from django.template.loader import render_to_string
+from django.utils.timezone import now
+
+from apps.models import OutgoingEmail
+
+EMAIL_TEMPLATE_DIR = 'apps/emails'
+
+
+def queue_email(to, subject, body, html_body='', send_after=None):
+    return OutgoingEmail.objects.create(to=to, subject=subject, body=body, html_body=html_body,
+                                        send_after=send_after or now())
+
+
+def queue_templated_email(to, template_name, context=None, send_after=None):
+    # apps/emails/<name>_subject.txt and <name>.txt, plus <name>.html when the template has one
+    context = context or {}
+    subject = render_to_string(f'{EMAIL_TEMPLATE_DIR}/{template_name}_subject.txt', context)
+    body = render_to_string(f'{EMAIL_TEMPLATE_DIR}/{template_name}.txt', context)
+    try:
+        html_body = render_to_string(f'{EMAIL_TEMPLATE_DIR}/{template_name}.html', context)
+    except TemplateDoesNotExist:
+        html_body = ''
+    return queue_email(to, ' '.join(subject.split()), body, html_body, send_after)
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=min(settings.EMAIL_RETRY_BACKOFF * 2 ** (attempts - 1), settings.EMAIL_RETRY_MAX_DELAY))
+
+
+def email_message(email, connection):
+    message = EmailMultiAlternatives(email.subject, email.body, settings.EMAIL_HOST_USER, [email.to],
+                                     connection=connection)
+    if email.html_body:
+        message.attach_alternative(email.html_body, 'text/html')
+    return message
+
+
+def sent_last_minute():
+    return OutgoingEmail.objects.filter(sent_at__gte=now() - timedelta(minutes=1)).count()
+
+
+def send_queued_emails(batch_size=None, rate_limit=None, connection=None, queryset=None):
+    # one batch of due emails over one open connection; returns (sent, failed)
+    batch_size = batch_size or settings.EMAIL_BATCH_SIZE
+    rate_limit = settings.EMAIL_RATE_LIMIT if rate_limit is None else rate_limit
+    if rate_limit:
+        batch_size = min(batch_size, rate_limit - sent_last_minute())
+    if batch_size <= 0:
+        return 0, 0
+
+    with transaction.atomic():
+        # skip_locked lets an overlapping run take the next batch instead of sending these twice
+        queryset = OutgoingEmail.objects.all() if queryset is None else queryset
+        emails = list(queryset.select_for_update(skip_locked=True).filter(
+            status=OutgoingEmail.Status.PENDING, send_after__lte=now()).order_by('send_after', 'id')[:batch_size])
+        if not emails:
+            return 0, 0
+
+        connection = connection or get_connection()
+        try:
+            connection.open()
+        except Exception as e:
+            # the server is unreachable: no email was tried, so no attempt is counted, but the whole batch
+            # waits out a backoff instead of being picked up again by the next beat
+            for email in emails:
+                email.last_error = f'{type(e).__name__}: {e}'
+                email.send_after = now() + retry_delay(email.attempts + 1)
+            OutgoingEmail.objects.bulk_update(emails, ['send_after', 'last_error'])
+            return 0, len(emails)
+
+        sent = failed = 0
+        with connection:  # already open, closed at the end of the batch
+            for email in emails:
+                email.attempts += 1
+                try:
+                    connection.send_messages([email_message(email, connection)])
+                except Exception as e:
+                    failed += 1
+                    email.last_error = f'{type(e).__name__}: {e}'
+                    if email.attempts >= settings.EMAIL_MAX_ATTEMPTS:
+                        email.status = OutgoingEmail.Status.FAILED
+                    else:
+                        email.send_after = now() + retry_delay(email.attempts)
+                    try:
+                        # the session may be broken after an error: start a fresh one for the rest of the batch
+                        connection.close()
+                        connection.open()
+                    except Exception:
+                        break
+                else:
+                    sent += 1
+                    email.status = OutgoingEmail.Status.SENT
+                    email.sent_at = now()
+                    email.last_error = ''
+        OutgoingEmail.objects.bulk_update(emails, ['status', 'attempts', 'send_after', 'sent_at', 'last_error'])
+    return sent, failed
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.models import Order
+from apps.orders import refresh_order_totals, snapshot_order_items
+
+
+class Command(BaseCommand):
+    help = ('Snapshot prices onto order items that predate snapshots, recompute their line totals and store every '
+            'order total, in batches')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, batch_size, **options):
+        last_pk = orders = items = 0
+        while True:
+            order_ids = list(Order.objects.filter(pk__gt=last_pk).order_by('pk')
+                             .values_list('pk', flat=True)[:batch_size])
+            if not order_ids:
+                break
+            with transaction.atomic():
+                items += snapshot_order_items(order_ids)
+                orders += refresh_order_totals(order_ids)
+            last_pk = order_ids[-1]
+            self.stdout.write(f'{orders} orders done')
+        self.stdout.write(self.style.SUCCESS(f'Snapshotted {items} order items, stored totals on {orders} orders'))
@@ -0,0 +1,67 @@
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, IntegrityError
+
+from apps.cart import add_to_cart, rebuild_cart_summary
+from apps.models import Product, User, CartItem
+
+
+class Command(BaseCommand):
+    help = 'Hammer one product with concurrent add-to-cart calls and report throughput and lost increments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', type=int, help='product id, defaults to the first product')
+        parser.add_argument('--clients', type=int, default=32)
+        parser.add_argument('--adds', type=int, default=200, help='adds per client')
+        parser.add_argument('--users', type=int, default=1, help='1 puts every client on the same cart row')
+        parser.add_argument('--legacy', action='store_true', help='use the old get_or_create + save path')
+
+    def handle(self, *args, clients, adds, users, legacy, **options):
+        product = Product.objects.filter(pk=options['product']).first() if options['product'] \
+            else Product.objects.order_by('pk').first()
+        if product is None:
+            raise CommandError('No product to benchmark against')
+
+        bench_users = [User.objects.get_or_create(username=f'bench_cart_{i}')[0] for i in range(users)]
+        CartItem.objects.filter(user__in=bench_users).delete()
+        add = self.legacy_add if legacy else add_to_cart
+
+        def client(index):
+            user = bench_users[index % users]
+            errors = 0
+            try:
+                for _ in range(adds):
+                    try:
+                        add(user.pk, product)
+                    except IntegrityError:
+                        errors += 1
+            finally:
+                connection.close()
+            return errors
+
+        started = perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            errors = sum(pool.map(client, range(clients)))
+        elapsed = perf_counter() - started
+
+        expected = clients * adds
+        stored = sum(CartItem.objects.filter(user__in=bench_users).values_list('quantity', flat=True))
+        rows = CartItem.objects.filter(user__in=bench_users).count()
+        self.stdout.write(
+            f'{"legacy" if legacy else "upsert"}: {expected} adds by {clients} clients in {elapsed:.2f}s '
+            f'({expected / elapsed:.0f} adds/s), stored quantity {stored}, lost {expected - stored}, '
+            f'cart rows {rows}, integrity errors {errors}'
+        )
+
+        CartItem.objects.filter(user__in=bench_users).delete()
+        for user in bench_users:
+            rebuild_cart_summary(user.pk)
+
+    @staticmethod
+    def legacy_add(user_id, product):
+        cart_item, created = CartItem.objects.get_or_create(user_id=user_id, product=product)
+        if not created:
+            cart_item.quantity += 1
+            cart_item.save()
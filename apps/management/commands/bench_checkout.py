@@ -0,0 +1,93 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+from statistics import quantiles
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Sum
+
+from apps.cart import add_many_to_cart, rebuild_cart_summary
+from apps.models import Product, User, Address, Order, OrderItem, CartItem
+from apps.orders import checkout, OutOfStock, CheckoutBusy
+
+
+class Command(BaseCommand):
+    help = 'Run parallel checkouts against a few hot products and report oversell, throughput and latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=3, help='hot products every cart draws from')
+        parser.add_argument('--stock', type=int, default=500, help='stock given to each hot product')
+        parser.add_argument('--clients', type=int, default=16)
+        parser.add_argument('--checkouts', type=int, default=20, help='checkouts per client')
+        parser.add_argument('--max-quantity', type=int, default=3)
+
+    def handle(self, *args, products, stock, clients, checkouts, max_quantity, **options):
+        hot = list(Product.objects.order_by('pk')[:products])
+        if len(hot) < products:
+            raise CommandError(f'Need at least {products} products')
+        original_stock = {product.pk: product.quantity for product in hot}
+        Product.objects.filter(pk__in=original_stock).update(quantity=stock)
+
+        users = []
+        for i in range(clients):
+            user = User.objects.get_or_create(username=f'bench_checkout_{i}')[0]
+            address = Address.objects.filter(user=user).first() or Address.objects.create(
+                user=user, full_name='Bench', street='Bench', zip_code=1, city='Bench', phone='0')
+            users.append((user, address))
+        CartItem.objects.filter(user__in=[user for user, _ in users]).delete()
+
+        def client(index):
+            user, address = users[index]
+            rng = random.Random(index)
+            timings, sold_out, busy = [], 0, 0
+            try:
+                for _ in range(checkouts):
+                    cart = {product: rng.randint(1, max_quantity) for product in rng.sample(hot, rng.randint(1, products))}
+                    add_many_to_cart(user.pk, cart)
+                    started = perf_counter()
+                    try:
+                        with transaction.atomic():
+                            checkout(Order.objects.create(payment_method=Order.PaymentMethod.PAYPAL,
+                                                          address=address, owner=user))
+                    except OutOfStock:
+                        sold_out += 1
+                        CartItem.objects.filter(user=user).delete()
+                    except CheckoutBusy:
+                        busy += 1
+                        CartItem.objects.filter(user=user).delete()
+                    timings.append(perf_counter() - started)
+            finally:
+                connection.close()
+            return timings, sold_out, busy
+
+        started = perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            results = list(pool.map(client, range(clients)))
+        elapsed = perf_counter() - started
+
+        timings = sorted(timing for result in results for timing in result[0])
+        sold_out = sum(result[1] for result in results)
+        busy = sum(result[2] for result in results)
+        bench_orders = Order.objects.filter(owner__in=[user for user, _ in users])
+        ordered = OrderItem.objects.filter(order__in=bench_orders, product__in=hot).aggregate(total=Sum('quantity'))
+        remaining = Product.objects.filter(pk__in=original_stock).aggregate(total=Sum('quantity'))['total']
+        sold = products * stock - remaining
+        placed = len(timings) - sold_out - busy
+        p50, p95 = (quantiles(timings, n=100, method='inclusive')[index] for index in (49, 94)) if len(timings) > 1 else (timings * 2)
+
+        self.stdout.write(
+            f'{len(timings)} checkouts by {clients} clients in {elapsed:.2f}s ({placed / elapsed:.0f} orders/s): '
+            f'{placed} placed, {sold_out} out of stock, {busy} lock timeouts\n'
+            f'latency p50 {p50 * 1000:.1f}ms, p95 {p95 * 1000:.1f}ms, max {timings[-1] * 1000:.1f}ms\n'
+            f'stock sold {sold}, quantity ordered {ordered["total"] or 0}, lowest stock left '
+            f'{Product.objects.filter(pk__in=original_stock).order_by("quantity").values_list("quantity", flat=True)[0]}'
+        )
+        if sold != (ordered['total'] or 0):
+            self.stderr.write(self.style.ERROR('Oversold: stock and order lines disagree'))
+
+        bench_orders.delete()
+        for product_id, quantity in original_stock.items():
+            Product.objects.filter(pk=product_id).update(quantity=quantity)
+        for user, _ in users:
+            rebuild_cart_summary(user.pk)
@@ -0,0 +1,53 @@
+from statistics import mean, quantiles
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import connection
+from django.test.utils import override_settings
+
+from apps.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Replay the request connection lifecycle with and without persistent connections and report the latency saved'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--max-age', type=int, default=60, help='CONN_MAX_AGE of the persistent runs')
+
+    def handle(self, *args, requests, max_age, **options):
+        modes = (
+            ('new connection per request', 0, False),
+            ('persistent', max_age, False),
+            ('persistent + health checks', max_age, True),
+        )
+        settings_dict = connection.settings_dict
+        saved = {key: settings_dict[key] for key in ('CONN_MAX_AGE', 'CONN_HEALTH_CHECKS')}
+        baseline = None
+        try:
+            # the connect counters would add cache round trips to the non-persistent run only
+            with override_settings(DB_POOL_STATS=False):
+                for label, conn_max_age, health_checks in modes:
+                    connection.close()
+                    settings_dict.update(CONN_MAX_AGE=conn_max_age, CONN_HEALTH_CHECKS=health_checks)
+                    self.request()
+                    latencies = [self.request() for _ in range(requests)]
+                    average = mean(latencies) * 1000
+                    p50, p99 = (quantiles(latencies, n=100, method='inclusive')[i] * 1000 for i in (49, 98))
+                    baseline = average if baseline is None else baseline
+                    self.stdout.write(
+                        f'{label}: mean {average:.2f}ms, p50 {p50:.2f}ms, p99 {p99:.2f}ms, '
+                        f'saved {baseline - average:.2f}ms per request'
+                    )
+        finally:
+            connection.close()
+            settings_dict.update(saved)
+
+    def request(self):
+        # the same signals the handlers send, so connections are kept or closed exactly as in a request
+        started = perf_counter()
+        request_started.send(sender=self.__class__)
+        list(Product.objects.values_list('id', 'name').order_by('-id')[:20])
+        request_finished.send(sender=self.__class__)
+        return perf_counter() - started
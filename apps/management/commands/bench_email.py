@@ -0,0 +1,53 @@
+from time import perf_counter
+
+from django.conf import settings
+from django.core.mail import get_connection, send_mail
+from django.core.management.base import BaseCommand
+
+from apps.mail import queue_email, send_queued_emails
+from apps.models import OutgoingEmail
+
+BENCH_DOMAIN = 'bench.invalid'
+
+
+class Command(BaseCommand):
+    help = 'Send queued emails in batches over one connection and report throughput against one send_mail per email'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=500)
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--backend', default='django.core.mail.backends.locmem.EmailBackend',
+                            help='point at smtp (e.g. a local debugging server) to measure connection setup too')
+        parser.add_argument('--legacy', action='store_true', help='one send_mail and one connection per email')
+
+    def handle(self, *args, messages, batch_size, backend, legacy, **options):
+        recipients = [f'user{i}@{BENCH_DOMAIN}' for i in range(messages)]
+        bench_emails = OutgoingEmail.objects.filter(to__endswith=f'@{BENCH_DOMAIN}')
+        bench_emails.delete()
+
+        started = perf_counter()
+        if legacy:
+            for to in recipients:
+                send_mail('Bench', 'Benchmark message', settings.EMAIL_HOST_USER, [to],
+                          connection=get_connection(backend))
+            sent, failed = messages, 0
+        else:
+            for to in recipients:
+                queue_email(to, 'Bench', 'Benchmark message')
+            queued = perf_counter()
+            sent = failed = 0
+            while True:
+                batch_sent, batch_failed = send_queued_emails(batch_size, rate_limit=0, queryset=bench_emails,
+                                                              connection=get_connection(backend))
+                if not batch_sent and not batch_failed:
+                    break
+                sent += batch_sent
+                failed += batch_failed
+            self.stdout.write(f'queued {messages} emails in {queued - started:.2f}s')
+        elapsed = perf_counter() - started
+
+        self.stdout.write(
+            f'{"legacy" if legacy else "queue"}: {sent} sent, {failed} failed in {elapsed:.2f}s '
+            f'({sent / elapsed:.0f} emails/s)'
+        )
+        bench_emails.delete()
@@ -0,0 +1,161 @@
+import json
+import tracemalloc
+from contextlib import ExitStack
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+
+from apps import urls
+from apps.models import CartItem, Category, Favorite, Order, Product, User
+
+
+def _pk(obj):
+    return obj and obj.pk
+
+
+class Command(BaseCommand):
+    help = 'Request every URL in apps/urls.py with the test client, record queries, time and memory, compare to a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='signed-in user; defaults to the first seed_bench user with a cart, '
+                                           'favourites and orders (bench_user_0 is staff)')
+        parser.add_argument('--anonymous', action='store_true')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--cold', action='store_true', help='clear the cache before every request')
+        parser.add_argument('--only', action='append', help='URL names to run, defaults to all')
+        parser.add_argument('--output', default='bench-results.json')
+        parser.add_argument('--baseline', help='earlier --output to compare with')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='allowed time increase over the baseline')
+
+    def handle(self, *args, user, anonymous, repeat, cold, only, output, baseline, tolerance, **options):
+        if anonymous:
+            user = None
+        elif user:
+            user = User.objects.filter(username=user).first()
+        else:
+            user = User.objects.filter(username__startswith='bench_user_', is_staff=False, cartitem__isnull=False,
+                                       favorite__isnull=False, orders__isnull=False).order_by('pk').first()
+        if not anonymous and user is None:
+            raise CommandError('No bench user: run seed_bench first or pass --anonymous')
+        sample_kwargs = self.sample_kwargs(user)
+
+        results = {}
+        for pattern in urls.urlpatterns:
+            if not isinstance(pattern, URLPattern) or (only and pattern.name not in only):
+                continue
+            kwargs = {name: sample_kwargs[pattern.name] for name in pattern.pattern.converters}
+            if None in kwargs.values():
+                self.stdout.write(f'{pattern.name}: skipped, no sample object')
+                continue
+            results[pattern.name] = result = self.measure(reverse(pattern.name, kwargs=kwargs), user, repeat, cold)
+            self.stdout.write(
+                f'{pattern.name}: {result["status"]}, {result["queries"]} queries, {result["time_ms"]:.1f}ms, '
+                f'peak {result["memory_kb"]:.0f}KB'
+            )
+
+        report = {
+            'user': 'anonymous' if anonymous else user.username,
+            'repeat': repeat,
+            'cold': cold,
+            'products': Product.objects.count(),
+            'endpoints': results,
+        }
+        Path(output).write_text(json.dumps(report, indent=2))
+        self.stdout.write(f'wrote {output}')
+        if baseline:
+            self.compare(json.loads(Path(baseline).read_text())['endpoints'], results, tolerance)
+
+    def sample_kwargs(self, user):
+        # the value of each URL parameter, per URL name; None skips the URL
+        product = Product.objects.order_by('-rating_count', 'pk').first()
+        cart_item = user and CartItem.objects.filter(user=user).order_by('pk').first()
+        favourite = user and Favorite.objects.filter(user=user).order_by('pk').first()
+        orders = Order.objects.filter(owner=user) if user and not user.is_staff else Order.objects.all()
+        order = user and orders.order_by('pk').first()
+        address = user and user.addresses.order_by('pk').first()
+        category = Category.objects.filter(product_count__gt=0).order_by('level', 'pk').first()
+        return {
+            'product_detail': _pk(product),
+            'product_reviews': _pk(product),
+            'category_products': category and category.slug,
+            'edit_address': _pk(address),
+            'cart_add': _pk(product),
+            'cart_remove': _pk(cart_item),
+            'addfavourites_page': _pk(product),
+            'update_quantity': _pk(cart_item),
+            'favorite_remove': _pk(favourite),
+            'order_detail': _pk(order),
+            'order_delete': _pk(order),
+            'download_pdf': _pk(order),
+        }
+
+    def measure(self, url, user, repeat, cold):
+        # every URL starts from the seeded data: the cart and favourite links write on GET
+        with transaction.atomic():
+            result = self.measure_requests(url, user, repeat, cold)
+            transaction.set_rollback(True)
+        return result
+
+    def measure_requests(self, url, user, repeat, cold):
+        # a client per URL: logout and the like only end their own session
+        # outside INTERNAL_IPS, so the debug toolbar stays out of the numbers; errors are recorded as 500s
+        client = Client(REMOTE_ADDR='192.0.2.1', raise_request_exception=False)
+        if user:
+            client.force_login(user)
+        client.get(url)
+
+        timings, queries = [], []
+        for _ in range(repeat):
+            if cold:
+                cache.clear()
+            with ExitStack() as stack:
+                captured = [stack.enter_context(CaptureQueriesContext(db)) for db in connections.all()]
+                started = perf_counter()
+                response = client.get(url)
+                timings.append(perf_counter() - started)
+            queries.append(sum(len(capture) for capture in captured))
+
+        # a separate pass: tracemalloc slows every allocation down
+        if cold:
+            cache.clear()
+        tracemalloc.start()
+        client.get(url)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        return {
+            'url': url,
+            'status': response.status_code,
+            'queries': max(queries),
+            'time_ms': median(timings) * 1000,
+            'min_ms': min(timings) * 1000,
+            'memory_kb': peak / 1024,
+        }
+
+    def compare(self, before, after, tolerance):
+        regressions = 0
+        for name, result in after.items():
+            if name not in before:
+                self.stdout.write(f'{name}: new')
+                continue
+            old = before[name]
+            notes = []
+            if result['queries'] > old['queries']:
+                notes.append(f'queries {old["queries"]} -> {result["queries"]}')
+            if result['time_ms'] > old['time_ms'] * (1 + tolerance):
+                notes.append(f'time {old["time_ms"]:.1f}ms -> {result["time_ms"]:.1f}ms')
+            if result['status'] != old['status']:
+                notes.append(f'status {old["status"]} -> {result["status"]}')
+            if notes:
+                regressions += 1
+                self.stdout.write(self.style.ERROR(f'{name}: {", ".join(notes)}'))
+        if regressions:
+            raise CommandError(f'{regressions} endpoints regressed against the baseline')
+        self.stdout.write(self.style.SUCCESS('no regressions against the baseline'))
@@ -0,0 +1,78 @@
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection, HTTPException
+from itertools import count, cycle
+from statistics import quantiles
+from threading import Lock
+from time import perf_counter
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from apps.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Load-test running deployments (e.g. make serve-wsgi and make serve-asgi) and compare requests/s and p99'
+
+    def add_arguments(self, parser):
+        parser.add_argument('targets', nargs='+', help='base URLs, e.g. http://127.0.0.1:8000 http://127.0.0.1:8001')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='defaults to the product list, the first product and the header counts')
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--requests', type=int, default=2000, help='per target')
+        parser.add_argument('--warmup', type=int, default=100)
+        parser.add_argument('--session', help='sessionid cookie, to load the pages as a signed-in user')
+
+    def handle(self, *args, targets, paths, concurrency, requests, warmup, session, **options):
+        if not paths:
+            product = Product.objects.order_by('pk').first()
+            if product is None:
+                raise CommandError('No product to load, pass --path')
+            paths = [reverse('product_list'), reverse('product_detail', args=[product.pk]), reverse('header_counts')]
+        headers = {'Cookie': f'sessionid={session}'} if session else {}
+
+        for target in targets:
+            self.run(target, paths, concurrency, warmup, headers)
+            started = perf_counter()
+            latencies, errors = self.run(target, paths, concurrency, requests, headers)
+            elapsed = perf_counter() - started
+            p50, p99 = (quantiles(latencies, n=100, method='inclusive')[i] * 1000 for i in (49, 98)) \
+                if len(latencies) > 1 else (0, 0)
+            self.stdout.write(
+                f'{target}: {len(latencies)} requests in {elapsed:.2f}s ({len(latencies) / elapsed:.0f} req/s), '
+                f'p50 {p50:.1f}ms, p99 {p99:.1f}ms, {errors} errors'
+            )
+
+    def run(self, target, paths, concurrency, requests, headers):
+        url = urlsplit(target)
+        tickets = count()
+        lock = Lock()
+
+        def client(index):
+            # one keep-alive connection per client, like a browser or a load balancer would hold
+            connection = HTTPConnection(url.hostname, url.port or 80, timeout=30)
+            latencies, errors = [], 0
+            for path in cycle(paths[index % len(paths):] + paths[:index % len(paths)]):
+                with lock:
+                    if next(tickets) >= requests:
+                        break
+                started = perf_counter()
+                try:
+                    connection.request('GET', url.path.rstrip('/') + path, headers=headers)
+                    response = connection.getresponse()
+                    response.read()
+                except (OSError, HTTPException):
+                    errors += 1
+                    connection.close()
+                    continue
+                if response.status >= 400:
+                    errors += 1
+                else:
+                    latencies.append(perf_counter() - started)
+            connection.close()
+            return latencies, errors
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(client, range(concurrency)))
+        return [latency for latencies, _ in results for latency in latencies], sum(errors for _, errors in results)
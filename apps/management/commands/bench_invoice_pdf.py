@@ -0,0 +1,49 @@
+import random
+import tracemalloc
+from io import BytesIO
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from apps.generate_pdf import write_pdf
+from apps.pdf_layout import string_width
+
+
+class Command(BaseCommand):
+    help = 'Render synthetic invoices with many lines and report pages/s, size, peak memory and metric cache hits'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=10_000)
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--products', type=int, default=500, help='distinct product names to draw from')
+        parser.add_argument('--output', help='also write the last invoice to this path')
+
+    def handle(self, *args, lines, repeat, products, output, **options):
+        rng = random.Random(42)
+        names = [f'Product {i} ' + 'x' * rng.randint(0, 60) for i in range(products)]
+        data = [(rng.choice(names), rng.randint(1, 20), rng.choice((0, 5, 10, 25)), rng.randint(1, 5000),
+                 rng.randint(0, 30)) for _ in range(lines)]
+
+        for run in range(1, repeat + 1):
+            string_width.cache_clear()
+            buffer = BytesIO()
+            started = perf_counter()
+            pages = write_pdf(buffer, run, data, tax=12)
+            elapsed = perf_counter() - started
+
+            metrics = string_width.cache_info()
+            self.stdout.write(
+                f'run {run}: {lines} lines, {pages} pages in {elapsed:.2f}s ({pages / elapsed:.0f} pages/s), '
+                f'{buffer.tell() / 1024:.0f} KiB, stringWidth cache {metrics.hits} hits / {metrics.misses} misses'
+            )
+
+        # separate pass: tracemalloc slows rendering down several times
+        tracemalloc.start()
+        write_pdf(BytesIO(), 0, data, tax=12)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.stdout.write(f'peak traced memory {peak / 1024 / 1024:.1f} MiB')
+
+        if output:
+            with open(output, 'wb') as file:
+                file.write(buffer.getvalue())
@@ -0,0 +1,58 @@
+from statistics import quantiles
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from apps.models import Product
+from apps.search import search_products
+
+QUERIES = [
+    'phone',  # matches a large share of the catalogue
+    'wireless headphones',
+    'samsung gaming monitor',
+    '"noise cancelling" -warranty',
+    'graphite 64GB',
+    'lenvo',  # typo, served by the trigram fallback
+    'headphnes wirless',
+]
+
+
+class Command(BaseCommand):
+    help = 'Time ranked product search (count and first page) for a set of queries and report p50/p95 latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', nargs='*', default=QUERIES)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--explain', action='store_true', help='print the plan of each first-page query')
+        parser.add_argument('--budget-ms', type=float, default=50, help='fail when a query\'s p95 is above this')
+
+    def handle(self, *args, queries, repeat, page_size, explain, budget_ms, **options):
+        self.stdout.write(f'{Product.objects.count()} products')
+        over_budget = []
+        for text in queries:
+            timings = []
+            for _ in range(repeat):
+                started = perf_counter()
+                with CaptureQueriesContext(connection) as captured:
+                    results, fuzzy = search_products(Product.objects.all(), text)
+                    count = results.count()
+                    page = list(results[:page_size])
+                timings.append(perf_counter() - started)
+
+            timings.sort()
+            p50, p95 = (quantiles(timings, n=100, method='inclusive')[index] for index in (49, 94)) if repeat > 1 else timings * 2
+            self.stdout.write(
+                f'{text!r:32} {"trigram" if fuzzy else "fts":7} {count:5} hits, {len(page):3} shown, '
+                f'{len(captured)} queries, p50 {p50 * 1000:.1f}ms, p95 {p95 * 1000:.1f}ms, max {timings[-1] * 1000:.1f}ms'
+                f'{" OVER BUDGET" if p95 * 1000 > budget_ms else ""}'
+            )
+            if p95 * 1000 > budget_ms:
+                over_budget.append(text)
+            if explain:
+                self.stdout.write(results[:page_size].explain(analyze=True))
+
+        if over_budget:
+            raise CommandError(f'p95 above {budget_ms:g}ms for {", ".join(map(repr, over_budget))}')
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from apps.cache import CACHE_STATS_NAMES, get_cache_stats, reset_cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Show hit/miss counts for the product page and fragment caches, as of each process\'s last flush'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help=f'defaults to {", ".join(CACHE_STATS_NAMES)}')
+        parser.add_argument('--reset', action='store_true', help='zero the counters after printing them')
+
+    def handle(self, *args, names, reset, **options):
+        names = names or CACHE_STATS_NAMES
+        for name, (hits, misses) in get_cache_stats(names).items():
+            lookups = hits + misses
+            ratio = f'{hits / lookups:.1%}' if lookups else '-'
+            self.stdout.write(f'{name}: {hits} hits, {misses} misses, hit ratio {ratio}')
+        if reset:
+            reset_cache_stats(names)
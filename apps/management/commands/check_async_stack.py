@@ -0,0 +1,67 @@
+import logging
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management.base import BaseCommand
+from django.urls import get_resolver, URLResolver
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.module_loading import import_string
+
+MIXIN_HOOKS = 'process_request', 'process_response'
+ADAPTED_HOOKS = 'process_view', 'process_template_response', 'process_exception'
+
+
+class Command(BaseCommand):
+    help = 'Report where an ASGI request leaves the event loop: adapted middleware, sync hooks and sync views'
+
+    def handle(self, *args, **options):
+        adapted = self.load_asgi_middleware()
+        hops = 0
+        for path in settings.MIDDLEWARE:
+            middleware = import_string(path)
+            notes = []
+            if f'middleware {path}' in adapted:
+                notes.append('sync only: adapted with sync_to_async as a whole')
+                hops += 1
+            else:
+                if isinstance(middleware, type) and issubclass(middleware, MiddlewareMixin) \
+                        and middleware.__acall__ is MiddlewareMixin.__acall__:
+                    hooks = [hook for hook in MIXIN_HOOKS if hasattr(middleware, hook)]
+                    notes += [f'{hook} runs in sync_to_async' for hook in hooks]
+                    hops += len(hooks)
+                for hook in ADAPTED_HOOKS:
+                    method = getattr(middleware, hook, None)
+                    if method is not None and not iscoroutinefunction(method):
+                        notes.append(f'{hook} runs in sync_to_async')
+                        if hook == 'process_view':
+                            hops += 1
+            self.stdout.write(f'{path}: {"; ".join(notes) or "async, no hops"}')
+        self.stdout.write(f'{hops} sync hops per request\n')
+
+        for route, callback in self.walk(get_resolver()):
+            kind = 'async' if iscoroutinefunction(callback) else 'sync'
+            self.stdout.write(f'{kind:5} /{route}')
+
+    def load_asgi_middleware(self):
+        # BaseHandler logs every sync middleware it has to wrap while building the async chain
+        messages = []
+        capture = logging.Handler(logging.DEBUG)
+        capture.emit = lambda record: messages.append(record.getMessage())
+        logger = logging.getLogger('django.request')
+        level = logger.level
+        logger.addHandler(capture)
+        logger.setLevel(logging.DEBUG)
+        try:
+            ASGIHandler()
+        finally:
+            logger.removeHandler(capture)
+            logger.setLevel(level)
+        return ' '.join(messages)
+
+    def walk(self, resolver, prefix=''):
+        for pattern in resolver.url_patterns:
+            if isinstance(pattern, URLResolver):
+                yield from self.walk(pattern, prefix + str(pattern.pattern))
+            else:
+                yield prefix + str(pattern.pattern), pattern.callback
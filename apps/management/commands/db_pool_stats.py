@@ -0,0 +1,64 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+
+from apps.db.stats import get_alias_stats, get_pool_stats, reset_alias_stats, reset_pool_stats
+
+APPLICATION_NAME_PREFIX = 'django_study:'
+
+
+class Command(BaseCommand):
+    help = 'Show the persistent connections each role holds in Postgres and how long opening new ones took'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='zero the connect and query counters after printing them')
+
+    def handle(self, *args, reset, **options):
+        roles = tuple(settings.DB_CONNECTION_BUDGET)
+        with connection.cursor() as cursor:
+            cursor.execute('SHOW max_connections')
+            max_connections = int(cursor.fetchone()[0])
+            # group by the application_name set in DATABASES; state is active while a query runs
+            cursor.execute(
+                'SELECT application_name, state, count(*), '
+                'coalesce(extract(epoch FROM max(now() - state_change)), 0) '
+                'FROM pg_stat_activity WHERE datname = current_database() AND pid <> pg_backend_pid() '
+                'GROUP BY application_name, state'
+            )
+            activity = cursor.fetchall()
+
+        self.stdout.write(
+            f'this process: role {settings.DB_ROLE}, CONN_MAX_AGE {connection.settings_dict["CONN_MAX_AGE"]}, '
+            f'health checks {"on" if connection.settings_dict["CONN_HEALTH_CHECKS"] else "off"}'
+        )
+        stats = get_pool_stats(roles)
+        for role in roles:
+            states = {state: (count, age) for name, state, count, age in activity
+                      if name == f'{APPLICATION_NAME_PREFIX}{role}'}
+            held = sum(count for count, _ in states.values())
+            in_use = sum(count for state, (count, _) in states.items() if state != 'idle')
+            idle, idle_age = states.get('idle', (0, 0))
+            connects = stats[role]['connects']
+            wait = f'{stats[role]["connect_us"] / connects / 1000:.2f}ms' if connects else '-'
+            self.stdout.write(
+                f'{role}: {held}/{settings.DB_CONNECTION_BUDGET[role]} connections held, {in_use} in use, '
+                f'{idle} idle (oldest idle {idle_age:.0f}s); {connects} opened, {stats[role]["closes"]} closed, '
+                f'average connect wait {wait}'
+            )
+            if held > settings.DB_CONNECTION_BUDGET[role]:
+                self.stderr.write(f'{role} holds more connections than its budget')
+
+        budget = sum(settings.DB_CONNECTION_BUDGET.values())
+        self.stdout.write(f'budget {budget} of max_connections {max_connections}')
+        if budget > max_connections:
+            self.stderr.write('the connection budgets exceed max_connections: lower them or put pgbouncer in front')
+
+        # request queries by alias, including the replicas the catalog pages read from
+        for alias, stats in get_alias_stats(list(connections)).items():
+            queries = stats['queries']
+            average = f'{stats["time_us"] / queries / 1000:.2f}ms' if queries else '-'
+            self.stdout.write(f'{alias}: {queries} queries, {stats["writes"]} writes, average {average}')
+
+        if reset:
+            reset_pool_stats(roles)
+            reset_alias_stats(list(connections))
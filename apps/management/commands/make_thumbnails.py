@@ -0,0 +1,54 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from apps.cache import bump_product_versions
+from apps.models import ProductImage
+from apps.tasks import make_thumbnails
+from apps.thumbnails import make_variants
+
+
+class Command(BaseCommand):
+    help = 'Generate the resized WebP/JPEG variants for product images that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Pillow releases the GIL while resizing')
+        parser.add_argument('--force', action='store_true', help='regenerate every image, not only the missing ones')
+        parser.add_argument('--queue', action='store_true', help='hand the images to the Celery workers instead')
+
+    def handle(self, *args, workers, force, queue, **options):
+        images = ProductImage.objects.exclude(image='').exclude(image__isnull=True)
+        if not force:
+            images = images.filter(thumbnail_widths=[])
+        ids = list(images.order_by('pk').values_list('pk', flat=True))
+
+        if queue:
+            for image_id in ids:
+                make_thumbnails.delay(image_id, force)
+            self.stdout.write(self.style.SUCCESS(f'Queued {len(ids)} images'))
+            return
+
+        def process(image_id):
+            try:
+                image = ProductImage.objects.get(pk=image_id)
+                make_variants(image, force=force)
+                return image.product_id
+            finally:
+                connection.close()
+
+        started = perf_counter()
+        done, failed, product_ids = 0, 0, set()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(process, image_id): image_id for image_id in ids}
+            for future in as_completed(futures):
+                try:
+                    product_ids.add(future.result())
+                    done += 1
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f'image {futures[future]}: {e}')
+        bump_product_versions(product_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'Made variants for {done} images in {perf_counter() - started:.1f}s, {failed} failed'))
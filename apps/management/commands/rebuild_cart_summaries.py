@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from apps.cart import rebuild_cart_summaries
+
+
+class Command(BaseCommand):
+    help = 'Recompute every CartSummary row from the cart items in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--user', type=int, action='append', dest='user_ids')
+
+    def handle(self, *args, batch_size, user_ids, **options):
+        rebuilt, emptied = rebuild_cart_summaries(user_ids=user_ids, batch_size=batch_size)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rebuilt} cart summaries, emptied {emptied}'))
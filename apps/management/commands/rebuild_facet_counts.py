@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from apps.facets import rebuild_facet_counts, rebuild_category_counts
+
+
+class Command(BaseCommand):
+    help = 'Recompute every specification facet count and per-category product count from the products'
+
+    def handle(self, *args, **options):
+        rows = rebuild_facet_counts()
+        categories = rebuild_category_counts()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rows} facet counts and {categories} category counts'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from apps.reviews import rebuild_rating_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored rating count, sum and histogram of every product from its reviews'
+
+    def handle(self, *args, **options):
+        products = rebuild_rating_stats()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rating stats for {products} products'))
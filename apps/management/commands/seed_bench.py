@@ -0,0 +1,251 @@
+import csv
+import json
+import random
+from datetime import timedelta
+from io import StringIO
+from time import perf_counter
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection
+from django.db.models import Max
+from django.utils.timezone import now
+
+from apps.cache import bump_category_tree_version, bump_tags_version
+from apps.cart import rebuild_cart_summaries
+from apps.facets import rebuild_category_counts, rebuild_facet_counts
+from apps.management.commands.seed_search_products import ADJECTIVES, BRANDS, COLORS, NOUNS, WORDS
+from apps.models import Address, CartItem, Category, Favorite, Order, OrderItem, Product, ProductImage, Review, User, \
+    SiteSettings
+from apps.reviews import rebuild_rating_stats
+
+BENCH_PASSWORD = 'bench'
+# share of 1..5 star reviews
+RATING_WEIGHTS = 5, 7, 15, 30, 43
+
+
+class Command(BaseCommand):
+    help = 'Generate a repeatable storefront dataset (category tree, products, users, carts, orders, reviews) with COPY'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=200)
+        parser.add_argument('--products', type=int, default=1_000_000)
+        parser.add_argument('--images', type=int, default=3, help='per product')
+        parser.add_argument('--users', type=int, default=10_000)
+        parser.add_argument('--cart-items', type=int, default=4, help='per user')
+        parser.add_argument('--favourites', type=int, default=6, help='per user')
+        parser.add_argument('--orders', type=int, default=3, help='per user')
+        parser.add_argument('--reviews', type=int, default=500_000)
+        parser.add_argument('--batch-size', type=int, default=50_000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--flush', action='store_true', help='empty the database first, the bench usernames are fixed')
+
+    def handle(self, *args, categories, products, images, users, cart_items, favourites, orders, reviews,
+               batch_size, seed, flush, **options):
+        if flush:
+            call_command('flush', interactive=False, verbosity=0)
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.started = perf_counter()
+        self.today = now()
+
+        if not SiteSettings.objects.exists():
+            SiteSettings.objects.create(tax=12)
+        leaves = self.seed_categories(categories)
+        product_ids = self.seed_products(products, leaves)
+        self.seed_images(product_ids, images)
+        user_ids, address_ids = self.seed_users(users)
+        self.seed_carts(user_ids, product_ids, cart_items)
+        self.seed_favourites(user_ids, product_ids, favourites)
+        self.seed_orders(user_ids, address_ids, product_ids, orders)
+        self.seed_reviews(product_ids, reviews)
+
+        # bulk loads skip the signals: rebuild what they would have kept current
+        rebuild_facet_counts()
+        rebuild_category_counts()
+        rebuild_rating_stats()
+        rebuild_cart_summaries()
+        call_command('backfill_order_totals', verbosity=0, stdout=StringIO())
+        with connection.cursor() as cursor:
+            models = [Product, ProductImage, User, Address, CartItem, Favorite, Order, OrderItem, Review]
+            for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(sql)
+            cursor.execute('ANALYZE')
+        bump_category_tree_version()
+        # every product page and fragment key includes the tags version: drop pages cached from an earlier seed
+        bump_tags_version()
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded in {perf_counter() - self.started:.0f}s; users bench_user_0.. sign in with "{BENCH_PASSWORD}"'))
+
+    def log(self, message):
+        self.stdout.write(f'[{perf_counter() - self.started:7.1f}s] {message}')
+
+    def seed_categories(self, count):
+        # three levels: a root per noun group, departments under it and leaves that hold the products
+        roots = Category.bulk_create_with_slugs(
+            [self.category(f'Bench {noun.title()}s') for noun in NOUNS[:max(1, count // 20)]])
+        departments = Category.bulk_create_with_slugs(
+            [self.category(f'{root.name} {adjective}', root) for root in roots for adjective in ADJECTIVES[:4]])
+        leaves = Category.bulk_create_with_slugs(
+            [self.category(f'{self.rng.choice(BRANDS)} {self.rng.choice(departments).name} {i}',
+                           self.rng.choice(departments))
+             for i in range(max(1, count - len(roots) - len(departments)))])
+        self.log(f'{len(roots) + len(departments) + len(leaves)} categories')
+        return [leaf.pk for leaf in leaves]
+
+    @staticmethod
+    def category(name, parent=None):
+        return Category(name=name, parent=parent)
+
+    def seed_products(self, count, leaves):
+        rng = self.rng
+
+        def rows(first_id):
+            for product_id in range(first_id, first_id + count):
+                noun = rng.choice(NOUNS)
+                yield (
+                    product_id,
+                    f'{rng.choice(BRANDS)} {rng.choice(ADJECTIVES)} {noun} {rng.choice("ABCDXZ")}{rng.randint(1, 999)}',
+                    rng.choice((0, 0, 0, 5, 10, 20, 50)),
+                    rng.randint(10, 5000),
+                    rng.randint(0, 500),
+                    rng.randint(0, 30),
+                    f'<p><strong>{" ".join(rng.choices(WORDS, k=8))}</strong></p>',
+                    ''.join(f'<p>{" ".join(rng.choices(WORDS, k=rng.randint(12, 40)))}.</p>' for _ in range(3)),
+                    json.dumps({'color': rng.choice(COLORS), 'memory': f'{rng.choice((4, 8, 16, 32, 64))}GB',
+                                'weight': rng.randint(100, 5000)}),
+                    self.days_ago(365),
+                    rng.choice(leaves),
+                    0, 0, '{0,0,0,0,0}',
+                )
+
+        fields = ('id', 'name', 'discount', 'price', 'quantity', 'shipping_cost', 'short_description', 'description',
+                  'specifications', 'created_at', 'category', 'rating_count', 'rating_sum', 'rating_histogram')
+        return self.copy(Product, fields, rows)
+
+    def seed_images(self, product_ids, per_product):
+        files = [f'products/{name}' for name in sorted(default_storage.listdir('products')[1])] \
+            if default_storage.exists('products') else []
+        files = files or ['products/1_1.jpg']
+
+        def rows(first_id):
+            image_id = first_id
+            for product_id in product_ids:
+                for image in self.rng.sample(files, min(per_product, len(files))):
+                    yield image_id, image, product_id, '{}'
+                    image_id += 1
+
+        return self.copy(ProductImage, ('id', 'image', 'product', 'thumbnail_widths'), rows)
+
+    def seed_users(self, count):
+        password = make_password(BENCH_PASSWORD)
+        first_user = self.next_id(User)
+
+        def users(first_id):
+            for user_id in range(first_id, first_id + count):
+                number = user_id - first_id
+                yield (user_id, password, False, f'bench_user_{number}', '', '', f'bench_user_{number}@example.com',
+                       number == 0, True, self.days_ago(730))
+
+        def addresses(first_id):
+            for address_id, user_id in enumerate(range(first_user, first_user + count), first_id):
+                yield (address_id, 'Bench User', f'{self.rng.randint(1, 200)} Bench street',
+                       self.rng.randint(10000, 99999), self.rng.choice(('Tashkent', 'Samarkand', 'Bukhara')),
+                       f'+998{self.rng.randint(100000000, 999999999)}', user_id, self.today, self.today)
+
+        user_ids = self.copy(User, ('id', 'password', 'is_superuser', 'username', 'first_name', 'last_name', 'email',
+                                    'is_staff', 'is_active', 'date_joined'), users)
+        address_ids = self.copy(Address, ('id', 'full_name', 'street', 'zip_code', 'city', 'phone', 'user',
+                                          'created_at', 'updated_at'), addresses)
+        return user_ids, address_ids
+
+    def seed_carts(self, user_ids, product_ids, per_user):
+        def rows(first_id):
+            item_id = first_id
+            for user_id in user_ids:
+                for product_id in self.popular_sample(product_ids, self.rng.randint(0, 2 * per_user)):
+                    yield item_id, product_id, self.rng.randint(1, 3), user_id
+                    item_id += 1
+
+        self.copy(CartItem, ('id', 'product', 'quantity', 'user'), rows)
+
+    def seed_favourites(self, user_ids, product_ids, per_user):
+        def rows(first_id):
+            favourite_id = first_id
+            for user_id in user_ids:
+                for product_id in self.popular_sample(product_ids, self.rng.randint(0, 2 * per_user)):
+                    yield favourite_id, user_id, product_id, self.days_ago(365)
+                    favourite_id += 1
+
+        self.copy(Favorite, ('id', 'user', 'product', 'created_at'), rows)
+
+    def seed_orders(self, user_ids, address_ids, product_ids, per_user):
+        owners = [(user_id, address_id) for user_id, address_id in zip(user_ids, address_ids)
+                  for _ in range(self.rng.randint(0, 2 * per_user))]
+
+        def orders(first_id):
+            for order_id, (user_id, address_id) in enumerate(owners, first_id):
+                created_at = self.days_ago(365)
+                yield (order_id, self.rng.choice(Order.PaymentMethod.values), self.rng.choice(Order.Status.values),
+                       address_id, user_id, '', 0, 0, 0, created_at, created_at)
+
+        order_ids = self.copy(Order, ('id', 'payment_method', 'status', 'address', 'owner', 'pdf_hash', 'subtotal',
+                                      'shipping_cost', 'total', 'created_at', 'updated_at'), orders)
+
+        # prices are snapshotted from the products by backfill_order_totals
+        def items(first_id):
+            item_id = first_id
+            for order_id in order_ids:
+                for product_id in self.popular_sample(product_ids, self.rng.randint(1, 4)):
+                    yield item_id, product_id, order_id, self.rng.randint(1, 3)
+                    item_id += 1
+
+        self.copy(OrderItem, ('id', 'product', 'order', 'quantity'), items)
+
+    def seed_reviews(self, product_ids, count):
+        def rows(first_id):
+            for review_id in range(first_id, first_id + count):
+                rating = self.rng.choices(Review.Rating.values, RATING_WEIGHTS)[0]
+                yield (review_id, self.popular_sample(product_ids, 1)[0], rating, f'Reviewer {review_id}',
+                       f'reviewer{review_id}@example.com', ' '.join(self.rng.choices(WORDS, k=self.rng.randint(5, 60))),
+                       self.days_ago(365).date())
+
+        self.copy(Review, ('id', 'product', 'rating', 'name', 'email', 'review_text', 'date_posted'), rows)
+
+    def popular_sample(self, ids, k):
+        # a few products collect most carts, favourites and reviews
+        return list({ids[int(len(ids) * self.rng.random() ** 3)] for _ in range(k)})
+
+    def days_ago(self, days):
+        return self.today - timedelta(seconds=self.rng.randint(0, days * 24 * 60 * 60))
+
+    @staticmethod
+    def next_id(model):
+        return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+    def copy(self, model, fields, rows):
+        # explicit ids continue after the current rows; the sequences are reset once everything is in
+        first_id = self.next_id(model)
+        table = connection.ops.quote_name(model._meta.db_table)
+        columns = ', '.join(connection.ops.quote_name(model._meta.get_field(field).column) for field in fields)
+        ids, buffer = [], StringIO()
+        writer = csv.writer(buffer, quoting=csv.QUOTE_ALL)
+        with connection.cursor() as cursor:
+            for row in rows(first_id):
+                ids.append(row[0])
+                writer.writerow(row)
+                if len(ids) % self.batch_size == 0:
+                    self.copy_buffer(cursor, table, columns, buffer)
+                    buffer.seek(0)
+                    buffer.truncate()
+            self.copy_buffer(cursor, table, columns, buffer)
+        self.log(f'{len(ids)} {model.__name__} rows')
+        return ids
+
+    @staticmethod
+    def copy_buffer(cursor, table, columns, buffer):
+        buffer.seek(0)
+        cursor.copy_expert(f'COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
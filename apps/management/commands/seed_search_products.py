@@ -0,0 +1,59 @@
+import random
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from apps.models import Category, Product
+
+BRANDS = 'Apple Samsung Xiaomi Lenovo Asus Acer Dell Sony Huawei Nokia Philips Bosch Canon Nikon Logitech'.split()
+NOUNS = ('phone laptop tablet monitor headphones speaker camera keyboard mouse router printer watch charger '
+         'television projector microphone drone console').split()
+ADJECTIVES = 'wireless portable gaming smart ultra compact professional mini pro slim rugged curved'.split()
+COLORS = 'black white silver blue red green gold graphite'.split()
+WORDS = ('battery display screen resolution performance design comfortable lightweight durable fast charging '
+         'storage memory processor sound quality noise cancelling bluetooth waterproof warranty premium '
+         'aluminium glass camera lens zoom sensor stabilization keyboard backlit refresh rate').split()
+
+
+class Command(BaseCommand):
+    help = 'Bulk insert synthetic products with realistic names, HTML descriptions and specs for search benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1_000_000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, count, batch_size, seed, **options):
+        rng = random.Random(seed)
+        root = Category.objects.filter(name='Search bench', parent=None).first() \
+            or Category.objects.create(name='Search bench')
+        categories = [Category.objects.filter(name=noun.title(), parent=root).first()
+                      or Category.objects.create(name=noun.title(), parent=root) for noun in NOUNS]
+
+        started = perf_counter()
+        for offset in range(0, count, batch_size):
+            Product.objects.bulk_create(
+                [self.product(rng, categories) for _ in range(min(batch_size, count - offset))],
+                batch_size=batch_size,
+            )
+            done = min(offset + batch_size, count)
+            self.stdout.write(f'{done} products, {done / (perf_counter() - started):.0f}/s')
+        self.stdout.write(self.style.SUCCESS(f'Inserted {count} products in {perf_counter() - started:.1f}s'))
+
+    @staticmethod
+    def product(rng, categories):
+        noun_index = rng.randrange(len(NOUNS))
+        name = f'{rng.choice(BRANDS)} {rng.choice(ADJECTIVES)} {NOUNS[noun_index]} {rng.choice("ABCDXZ")}{rng.randint(1, 999)}'
+        paragraphs = ''.join(f'<p>{" ".join(rng.choices(WORDS, k=rng.randint(12, 40)))}.</p>' for _ in range(3))
+        return Product(
+            name=name,
+            price=rng.randint(10, 5000),
+            discount=rng.choice((0, 0, 0, 5, 10, 20, 50)),
+            quantity=rng.randint(0, 500),
+            shipping_cost=rng.randint(0, 30),
+            short_description=f'<p><strong>{" ".join(rng.choices(WORDS, k=8))}</strong></p>',
+            description=paragraphs,
+            specifications={'color': rng.choice(COLORS), 'memory': f'{rng.choice((4, 8, 16, 32, 64))}GB',
+                            'weight': rng.randint(100, 5000)},
+            category=categories[noun_index],
+        )
@@ -0,0 +1,123 @@
+import logging
+import os
+import re
+from collections import defaultdict
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.conf import settings
+from django.template import TemplateDoesNotExist
+from django.template.backends import django as django_backend
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, \
+    generate_latest, multiprocess
+
+from apps.db.stats import request_sql
+
+logger = logging.getLogger(__name__)
+
+# "IN (%s, %s, %s)" and "IN (%s, %s)" are one shape
+SQL_PARAM_LIST = re.compile(r'\((?:%s, )+%s\)')
+
+REQUEST_LATENCY = Histogram('django_request_latency_seconds', 'Request latency by URL name', ['view', 'method'])
+REQUESTS = Counter('django_requests', 'Responses by URL name and status', ['view', 'method', 'status'])
+REQUEST_QUERIES = Histogram('django_request_queries', 'Database queries per request', ['view'],
+                            buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500))
+REQUEST_DB_TIME = Histogram('django_request_db_seconds', 'Database time per request', ['view'])
+TEMPLATE_RENDER_TIME = Histogram('django_template_render_seconds', 'Template render time per request', ['view'])
+CACHE_LOOKUPS = Counter('django_cache_lookups', 'Page and fragment cache lookups', ['view', 'cache', 'result'])
+N_PLUS_ONE = Counter('django_n_plus_one', 'Requests repeating one SQL shape METRICS_N_PLUS_ONE_THRESHOLD times',
+                     ['view'])
+
+request_metrics = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    __slots__ = 'started', 'template_seconds', 'template_depth', 'cache_lookups', 'sql'
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.template_seconds = 0.0
+        self.template_depth = 0
+        self.cache_lookups = []
+        self.sql = defaultdict(int)
+
+
+def start_request_metrics():
+    metrics = RequestMetrics()
+    request_metrics.set(metrics)
+    request_sql.set(metrics.sql)
+    return metrics
+
+
+def finish_request_metrics(request, response, metrics):
+    request_metrics.set(None)
+    request_sql.set(None)
+    view = request.resolver_match.view_name if request.resolver_match else 'unresolved'
+    if view == 'metrics':
+        return
+
+    REQUEST_LATENCY.labels(view, request.method).observe(perf_counter() - metrics.started)
+    REQUESTS.labels(view, request.method, response.status_code).inc()
+    # the per-alias tally of DatabaseRoutingMiddleware
+    queries = getattr(request, 'db_queries', {}).values()
+    REQUEST_QUERIES.labels(view).observe(sum(count for count, _, _ in queries))
+    REQUEST_DB_TIME.labels(view).observe(sum(seconds for _, seconds, _ in queries))
+    if metrics.template_seconds:
+        TEMPLATE_RENDER_TIME.labels(view).observe(metrics.template_seconds)
+    for name, hit in metrics.cache_lookups:
+        CACHE_LOOKUPS.labels(view, name, 'hit' if hit else 'miss').inc()
+    log_n_plus_one(view, metrics.sql)
+
+
+def log_n_plus_one(view, sql_counts):
+    shapes = defaultdict(int)
+    for sql, count in sql_counts.items():
+        shapes[SQL_PARAM_LIST.sub('(%s, ...)', sql)] += count
+    repeated = [(count, shape) for shape, count in shapes.items() if count >= settings.METRICS_N_PLUS_ONE_THRESHOLD]
+    if repeated:
+        N_PLUS_ONE.labels(view).inc()
+    for count, shape in repeated:
+        logger.warning('Possible N+1 in %s: %d queries of %s', view, count, shape[:500])
+
+
+def observe_cache_lookup(name, hit):
+    metrics = request_metrics.get()
+    if metrics is not None:
+        metrics.cache_lookups.append((name, hit))
+
+
+def export_metrics():
+    # gunicorn workers each write their samples to PROMETHEUS_MULTIPROC_DIR, see the Makefile
+    registry = REGISTRY
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class Template(django_backend.Template):
+    def render(self, context=None, request=None):
+        metrics = request_metrics.get()
+        if metrics is None:
+            return super().render(context, request)
+        # only the outermost template: nested renders are part of its time
+        metrics.template_depth += 1
+        started = perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_depth -= 1
+            if not metrics.template_depth:
+                metrics.template_seconds += perf_counter() - started
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    # the stock backend, timing renders for the sampled requests
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            django_backend.reraise(exc, self)
@@ -0,0 +1,97 @@
+from random import random
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import middleware as auth
+from django.contrib.messages import middleware as messages
+from django.contrib.sessions import middleware as sessions
+from django.middleware import clickjacking, common, csrf, security
+from django.utils.deprecation import MiddlewareMixin
+
+from apps.db.stats import record_alias_queries, request_queries
+from apps.metrics import finish_request_metrics, start_request_metrics
+
+
+class InlineHooksMixin:
+    # MiddlewareMixin runs process_request/process_response through sync_to_async on every ASGI request.
+    # These hooks only read and write headers, cookies and lazy objects, so they run on the event loop instead.
+    async def __acall__(self, request):
+        response = None
+        if hasattr(self, 'process_request'):
+            response = self.process_request(request)
+        response = response or await self.get_response(request)
+        if hasattr(self, 'process_response'):
+            response = await self.aprocess_response(request, response)
+        return response
+
+    async def aprocess_response(self, request, response):
+        return self.process_response(request, response)
+
+
+class SecurityMiddleware(InlineHooksMixin, security.SecurityMiddleware):
+    pass
+
+
+class SessionMiddleware(InlineHooksMixin, sessions.SessionMiddleware):
+    async def aprocess_response(self, request, response):
+        # saving the session is the only database write in the stack
+        if request.session.modified or settings.SESSION_SAVE_EVERY_REQUEST:
+            return await sync_to_async(self.process_response)(request, response)
+        return self.process_response(request, response)
+
+
+class CommonMiddleware(InlineHooksMixin, common.CommonMiddleware):
+    pass
+
+
+class CsrfViewMiddleware(InlineHooksMixin, csrf.CsrfViewMiddleware):
+    pass
+
+
+class AuthenticationMiddleware(InlineHooksMixin, auth.AuthenticationMiddleware):
+    pass
+
+
+class MessageMiddleware(InlineHooksMixin, messages.MessageMiddleware):
+    async def aprocess_response(self, request, response):
+        # storing read or new messages may go to the session
+        storage = getattr(request, '_messages', None)
+        if storage is not None and (storage.used or storage.added_new):
+            return await sync_to_async(self.process_response)(request, response)
+        return self.process_response(request, response)
+
+
+class XFrameOptionsMiddleware(InlineHooksMixin, clickjacking.XFrameOptionsMiddleware):
+    pass
+
+
+class DatabaseRoutingMiddleware(InlineHooksMixin, MiddlewareMixin):
+    # pins a client to default for REPLICA_PIN_SECONDS after it wrote, and sums the queries per alias
+    def process_request(self, request):
+        request.db_pinned = settings.REPLICA_PIN_COOKIE in request.COOKIES
+        request.db_queries = {}
+        request_queries.set(request.db_queries)
+
+    def process_response(self, request, response):
+        queries = getattr(request, 'db_queries', None)
+        if queries is None:
+            return response
+        request_queries.set(None)
+        record_alias_queries(queries)
+        if settings.REPLICA_DATABASES and any(writes for _, _, writes in queries.values()):
+            response.set_cookie(settings.REPLICA_PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS,
+                                httponly=True, samesite='Lax')
+        return response
+
+
+class MetricsMiddleware(InlineHooksMixin, MiddlewareMixin):
+    # METRICS_SAMPLE_RATE of the requests feed the histograms on /metrics; 0 turns the instrumentation off
+    def process_request(self, request):
+        if settings.METRICS_SAMPLE_RATE and random() < settings.METRICS_SAMPLE_RATE:
+            request.metrics = start_request_metrics()
+
+    def process_response(self, request, response):
+        metrics = getattr(request, 'metrics', None)
+        if metrics is not None:
+            finish_request_metrics(request, response, metrics)
+        return response
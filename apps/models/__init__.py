@@ -1,3 +1,4 @@
-from apps.models.product import ProductImage, Product, CartItem, Category, Favorite, Review,Tag
+from apps.models.product import ProductImage, Product, CartItem, CartSummary, SpecFacetCount, Category, Favorite, Review,Tag
 from apps.models.user import User, Address,SiteSettings
-from apps.models.order import Order,OrderItem,CreditCard
\ No newline at end of file
+from apps.models.order import Order,OrderItem,CreditCard
+from apps.models.mail import OutgoingEmail
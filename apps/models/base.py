@@ -1,6 +1,44 @@
-from django.db.models import Model, CharField, SlugField, DateTimeField
+import re
+
+from django.db import IntegrityError, transaction
+from django.db.models import Model, CharField, SlugField, DateTimeField, Q
 from django.utils.text import slugify
 
+SLUG_MAX_BASE_LENGTH = 240
+SLUG_SAVE_ATTEMPTS = 5
+
+
+def slug_base(model, name):
+    return slugify(name)[:SLUG_MAX_BASE_LENGTH].strip('-') or model._meta.model_name
+
+
+def allocate_slugs(model, names):
+    bases = [slug_base(model, name) for name in names]
+    unique_bases = set(bases)
+
+    # one lookup on the slug index: every "<base>" and "<base>-<n>" already taken
+    lookup = Q(slug__in=unique_bases)
+    for base in unique_bases:
+        lookup |= Q(slug__startswith=f'{base}-', slug__regex=rf'^{re.escape(base)}-[0-9]+$')
+
+    taken, last_suffix = set(), {}
+    for slug in model._default_manager.filter(lookup).values_list('slug', flat=True).iterator():
+        if slug in unique_bases:
+            taken.add(slug)
+        base, _, suffix = slug.rpartition('-')
+        if base in unique_bases and suffix.isdigit():
+            last_suffix[base] = max(last_suffix.get(base, 0), int(suffix))
+
+    slugs = []
+    for base in bases:
+        if base not in taken:
+            taken.add(base)
+            slugs.append(base)
+        else:
+            last_suffix[base] = last_suffix.get(base, 0) + 1
+            slugs.append(f'{base}-{last_suffix[base]}')
+    return slugs
+
 
 class SlugBaseModel(Model):
     name = CharField(max_length=255)
@@ -9,12 +47,42 @@ class SlugBaseModel(Model):
     class Meta:
         abstract = True
 
+    def has_slug_for_name(self):
+        base = slug_base(self.__class__, self.name)
+        return bool(self.slug) and re.fullmatch(rf'{re.escape(base)}(-[0-9]+)?', self.slug) is not None
+
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
-        self.slug = slugify(self.name)
-        while self.__class__.objects.filter(slug=self.slug).exists():
-            self.slug += '-1'
+        if self.has_slug_for_name() or (update_fields is not None and 'name' not in update_fields):
+            return super().save(force_insert=force_insert, force_update=force_update, using=using,
+                                update_fields=update_fields)
+        if update_fields is not None and 'slug' not in update_fields:
+            # a renamed row gets its new slug written with the name
+            update_fields = [*update_fields, 'slug']
+
+        for attempt in range(1, SLUG_SAVE_ATTEMPTS + 1):
+            self.slug = allocate_slugs(self.__class__, [self.name])[0]
+            try:
+                with transaction.atomic(using=using):
+                    return super().save(force_insert=force_insert, force_update=force_update, using=using,
+                                        update_fields=update_fields)
+            except IntegrityError:
+                # a concurrent insert took the suffix between the lookup and our write
+                taken = self.__class__._default_manager.filter(slug=self.slug).exclude(pk=self.pk).exists()
+                if attempt == SLUG_SAVE_ATTEMPTS or not taken:
+                    raise
 
-        super().save(force_insert, force_update, using, update_fields)
+    @classmethod
+    def bulk_create_with_slugs(cls, objs, batch_size=None):
+        objs = list(objs)
+        for attempt in range(1, SLUG_SAVE_ATTEMPTS + 1):
+            for obj, slug in zip(objs, allocate_slugs(cls, [obj.name for obj in objs])):
+                obj.slug = slug
+            try:
+                with transaction.atomic():
+                    return cls._default_manager.bulk_create(objs, batch_size=batch_size)
+            except IntegrityError:
+                if attempt == SLUG_SAVE_ATTEMPTS:
+                    raise
 
     def __str__(self):
         return self.name
@@ -25,4 +93,4 @@ class CreatedBaseModel(Model):
     created_at = DateTimeField(auto_now_add=True)
 
     class Meta:
-        abstract = True
\ No newline at end of file
+        abstract = True
@@ -0,0 +1,32 @@
+from django.db.models import CharField, TextChoices, EmailField, TextField, PositiveSmallIntegerField, DateTimeField, \
+    Index, Q
+from django.utils.timezone import now
+
+from apps.models.base import CreatedBaseModel
+
+
+class OutgoingEmail(CreatedBaseModel):
+    class Status(TextChoices):
+        PENDING = 'pending', 'Pending'
+        SENT = 'sent', 'Sent'
+        FAILED = 'failed', 'Failed'
+
+    to = EmailField()
+    subject = CharField(max_length=255)
+    body = TextField()
+    html_body = TextField(blank=True, default='')
+    status = CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    attempts = PositiveSmallIntegerField(default=0)
+    send_after = DateTimeField(default=now)
+    sent_at = DateTimeField(null=True, blank=True)
+    last_error = TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [
+            # the drain query only ever looks at pending rows that are due
+            Index(fields=['send_after', 'id'], condition=Q(status='pending'), name='outgoingemail__pending__idx'),
+            Index(fields=['sent_at'], name='outgoingemail__sent_at__idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.subject} to {self.to}'
@@ -1,5 +1,5 @@
-from django.db.models import Model, CharField, ForeignKey, CASCADE, TextChoices, PositiveIntegerField, DateField, Sum, \
-    F, FileField
+from django.db.models import Model, CharField, ForeignKey, CASCADE, TextChoices, PositiveIntegerField, DateField, \
+    FileField, Index, IntegerField
 
 from apps.models.base import CreatedBaseModel
 
@@ -20,23 +20,52 @@ class Order(CreatedBaseModel):
     address = ForeignKey('apps.Address', CASCADE, related_name='orders')
     owner = ForeignKey('apps.User', CASCADE, related_name='orders')
     pdf_file = FileField(upload_to='order/pdf/', null=True, blank=True)
+    pdf_hash = CharField(max_length=64, blank=True, default='')
+    subtotal = IntegerField(default=0)
+    shipping_cost = IntegerField(default=0)
+    total = IntegerField(default=0)
 
-    @property
-    def total(self):
-        return self.order_items.aggregate(
-            total=Sum((F('quantity') * F('product__price') * (100 - F('product__discount')) / 100) + F(
-                'product__shipping_cost'))
-        )
+    class Meta:
+        indexes = [
+            Index(fields=['-created_at', '-id'], name='order__created_at__id__idx'),
+            Index(fields=['owner', '-created_at', '-id'], name='order__owner__created_at__idx'),
+        ]
 
 
 class OrderItem(Model):
     product = ForeignKey('apps.Product', CASCADE)
     order = ForeignKey('apps.Order', CASCADE, related_name='order_items')
     quantity = PositiveIntegerField()
+    # frozen from the product when the order is placed; null until snapshotted
+    unit_price = IntegerField(null=True, blank=True)
+    discount = PositiveIntegerField(null=True, blank=True)
+    shipping_cost = PositiveIntegerField(null=True, blank=True)
+    line_total = IntegerField(null=True, blank=True)
+
+    def snapshot(self, product=None):
+        product = product or self.product
+        self.unit_price = product.price
+        self.discount = product.discount
+        self.shipping_cost = product.shipping_cost
+        self.line_total = self.quantity * product.effective_price
+
+    def update_line_total(self):
+        # same per-unit rounding as Product.effective_price
+        self.line_total = self.quantity * (self.unit_price * (100 - self.discount) // 100)
+
+    def save(self, *args, **kwargs):
+        if self.unit_price is None:
+            self.snapshot()
+        else:
+            self.update_line_total()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'quantity' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'line_total'}
+        super().save(*args, **kwargs)
 
     @property
     def amount(self):
-        return self.quantity * self.product.current_price
+        return self.line_total + self.quantity * self.shipping_cost
 
 class CreditCard(CreatedBaseModel):
     order = ForeignKey('apps.Order', CASCADE)
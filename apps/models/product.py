@@ -1,36 +1,47 @@
 from datetime import timedelta
 
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex, GistIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField, SearchVectorCombinable
 from django.db.models import Model, ImageField, CharField, PositiveIntegerField, JSONField, DateTimeField, ForeignKey, \
-    CASCADE, CheckConstraint, Q, IntegerField, TextChoices, EmailField, TextField, DateField, SlugField, IntegerChoices
-from django.utils.text import slugify
+    CASCADE, CheckConstraint, Q, IntegerField, TextChoices, EmailField, TextField, DateField, IntegerChoices, \
+    OneToOneField, UniqueConstraint, GeneratedField, Func, F, Value, Index, FloatField
+from django.db.models.functions import Cast, Greatest
 from django.utils.timezone import now
 from django_ckeditor_5.fields import CKEditor5Field
 from mptt.models import MPTTModel, TreeForeignKey
 
+from apps.models.base import SlugBaseModel
 from root.settings import AUTH_USER_MODEL
 
 
-class Category(MPTTModel):
-    name = CharField(max_length=255)
-    slug = SlugField(max_length=255, unique=True, editable=False)
+class Category(SlugBaseModel, MPTTModel):
     parent = TreeForeignKey('self', CASCADE, null=True, blank=True, related_name='children')
+    # products in this category and all of its descendants, kept current by the Product signals
+    product_count = PositiveIntegerField(default=0, editable=False)
 
     class MPTTMeta:
         order_insertion_by = ['name']
 
-    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
-        self.slug = slugify(self.name)
-        while Category.objects.filter(slug=self.slug).exists():
-            self.slug += '-1'
-        super().save(force_insert, force_update, using, update_fields)
-
-    def __str__(self):
-        return self.name
-
     class Meta:
         verbose_name_plural = 'Categories'
         verbose_name = 'Category'
 
+    @classmethod
+    def bulk_create_with_slugs(cls, objs, batch_size=None):
+        # bulk_create skips the MPTT bookkeeping: insert with placeholder tree fields, then renumber the whole
+        # tree once; like bulk_create it sends no signals, so the caller bumps the category tree version
+        objs = list(objs)
+        for obj in objs:
+            obj.lft = obj.rght = obj.tree_id = obj.level = 0
+        created = super().bulk_create_with_slugs(objs, batch_size=batch_size)
+        cls._tree_manager.rebuild()
+        rows = cls.objects.filter(pk__in=[obj.pk for obj in created]).values_list('pk', 'lft', 'rght', 'tree_id', 'level')
+        tree_fields = {pk: fields for pk, *fields in rows}
+        for obj in created:
+            obj.lft, obj.rght, obj.tree_id, obj.level = tree_fields[obj.pk]
+        return created
+
 
 class Tag(Model):
     name = CharField(max_length=50),
@@ -39,6 +50,27 @@ class Tag(Model):
         return self.name
 
 
+SEARCH_CONFIG = 'english'
+
+
+def _strip_html(field):
+    return Func(F(field), Value(r'<[^>]*>|&[#\w]+;'), Value(' '), Value('g'), function='regexp_replace',
+                output_field=TextField())
+
+
+class _SpecValuesVector(SearchVectorCombinable, Func):
+    # every string and number in the JSON, keys are left out
+    template = f"setweight(jsonb_to_tsvector('{SEARCH_CONFIG}'::regconfig, %(expressions)s, '[\"string\", \"numeric\"]'), 'B')"
+    output_field = SearchVectorField()
+
+
+RATING_SCALE = 5
+
+
+def empty_rating_histogram():
+    return [0] * RATING_SCALE
+
+
 class Product(Model):
     name = CharField(max_length=255)
     discount = PositiveIntegerField(default = 0, db_default=0)
@@ -50,6 +82,29 @@ class Product(Model):
     specifications = JSONField()
     created_at = DateTimeField(auto_now_add=True)
     category = ForeignKey('apps.Category', CASCADE, related_name='products')
+    effective_price = GeneratedField(
+        expression=F('price') * (100 - F('discount')) / 100,
+        output_field=IntegerField(),
+        db_persist=True,
+    )
+    search_vector = GeneratedField(
+        expression=SearchVector('name', weight='A', config=SEARCH_CONFIG)
+                   + SearchVector(_strip_html('short_description'), weight='B', config=SEARCH_CONFIG)
+                   + _SpecValuesVector('specifications')
+                   + SearchVector(_strip_html('description'), weight='C', config=SEARCH_CONFIG),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+    # kept current by the Review signals; rating_histogram[0] counts the 1-star reviews
+    rating_count = PositiveIntegerField(default=0, editable=False)
+    rating_sum = PositiveIntegerField(default=0, editable=False)
+    rating_histogram = ArrayField(PositiveIntegerField(), size=RATING_SCALE, default=empty_rating_histogram,
+                                  editable=False)
+    rating_average = GeneratedField(
+        expression=Cast('rating_sum', FloatField()) / Greatest('rating_count', 1),
+        output_field=FloatField(),
+        db_persist=True,
+    )
 
     class Meta:
         constraints = [
@@ -58,13 +113,36 @@ class Product(Model):
                 name="discount__lte__100",
             )
         ]
+        indexes = [
+            Index(fields=['category', '-created_at', '-id'], name='product__category_created_idx'),
+            Index(fields=['effective_price', 'id'], name='product__effective_price_idx'),
+            Index(fields=['-rating_average', '-rating_count', '-id'], name='product__rating_idx'),
+            GinIndex(fields=['search_vector'], name='product__search_vector__idx'),
+            GinIndex(fields=['specifications'], opclasses=['jsonb_path_ops'], name='product__specifications__idx'),
+            # GiST, not GIN: the search fallback orders by trigram distance and needs a KNN scan
+            GistIndex(fields=['name'], opclasses=['gist_trgm_ops'], name='product__name__trgm_gist_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
     @property
     def current_price(self):
-        return int(self.price - self.discount * self.price / 100) + self.shipping_cost
+        return self.effective_price + self.shipping_cost
+
+    @property
+    def rating_stars(self):
+        # icon classes for five stars, rounded to the nearest half
+        halves = round(self.rating_average * 2)
+        return ['fa-star text-warning' if halves >= 2 * star else
+                'fa-star-half-alt text-warning' if halves == 2 * star - 1 else 'fa-star text-300'
+                for star in range(1, RATING_SCALE + 1)]
+
+    @property
+    def rating_distribution(self):
+        # (stars, count, percent), best first
+        return [(stars, count, round(100 * count / self.rating_count) if self.rating_count else 0)
+                for stars, count in reversed(list(enumerate(self.rating_histogram, 1)))]
 
     @property
     def is_new(self):
@@ -79,6 +157,8 @@ class Product(Model):
 class ProductImage(Model):
     image = ImageField(upload_to='products/', null=True)
     product = ForeignKey('apps.Product', CASCADE, related_name='images')
+    # widths of the resized variants on storage, filled in by the thumbnail task
+    thumbnail_widths = ArrayField(PositiveIntegerField(), default=list, blank=True, editable=False)
 
 
 class CartItem(Model):
@@ -86,6 +166,14 @@ class CartItem(Model):
     quantity = PositiveIntegerField(default=1)
     user = ForeignKey('apps.User',CASCADE)
 
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                fields=['user', 'product'],
+                name="cartitem__user__product__unique",
+            )
+        ]
+
     def __str__(self):
         return self.product.name
     @property
@@ -93,6 +181,30 @@ class CartItem(Model):
         return self.product.price * self.quantity
 
 
+class CartSummary(Model):
+    user = OneToOneField('apps.User', CASCADE, primary_key=True, related_name='cart_summary')
+    item_count = PositiveIntegerField(default=0)
+    subtotal = IntegerField(default=0)
+    shipping = IntegerField(default=0)
+    total = IntegerField(default=0)
+
+
+class SpecFacetCount(Model):
+    # products per (category, spec key, spec value), kept current by the Product signals
+    category = ForeignKey('apps.Category', CASCADE, related_name='spec_facets')
+    key = CharField(max_length=100)
+    value = CharField(max_length=255)
+    count = IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                fields=['category', 'key', 'value'],
+                name="specfacetcount__category__key__value__unique",
+            )
+        ]
+
+
 class Favorite(Model):
     user = ForeignKey("apps.User", CASCADE)
     product = ForeignKey(Product, CASCADE)
@@ -107,15 +219,12 @@ class Favorite(Model):
 
 class Review(Model):
     class Rating(IntegerChoices):
-            (1, '1 star'),
-            (1.5, '1.5 star'),
-            (2, '2 stars'),
-            (2.5, '2.5 stars'),
-            (3, '3 stars'),
-            (3.5, ' 3.5 stars'),
-            (4, '4 stars'),
-            (4.5, '4.5 stars'),
-            (5, '5 stars'),
+        ONE = 1, '1 star'
+        TWO = 2, '2 stars'
+        THREE = 3, '3 stars'
+        FOUR = 4, '4 stars'
+        FIVE = 5, '5 stars'
+
     product = ForeignKey(Product, CASCADE, related_name='reviews')
     rating = IntegerField(choices=Rating.choices)
     name = CharField(max_length=255)
@@ -123,6 +232,18 @@ class Review(Model):
     review_text = TextField()
     date_posted = DateField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            CheckConstraint(
+                check=Q(rating__gte=1, rating__lte=RATING_SCALE),
+                name="review__rating__between__1__5",
+            )
+        ]
+        indexes = [
+            Index(fields=['product', '-id'], name='review__product__id__idx'),
+            Index(fields=['product', '-rating', '-id'], name='review__product__rating__idx'),
+        ]
+
     def __str__(self):
         return f"Review by {self.name} on {self.date_posted}"
 
@@ -0,0 +1,104 @@
+from functools import partial
+
+from django.conf import settings
+from django.db import connection, transaction, OperationalError
+from django.db.models import Sum, F, OuterRef, Subquery, Value, Case, When
+from django.db.models.functions import Coalesce
+
+from apps.cache import bump_product_versions
+from apps.models import Order, OrderItem, Product, CartItem, CartSummary
+
+ORDER_LINE_TOTAL = F('quantity') * (F('unit_price') * (100 - F('discount')) / 100)
+
+
+def _order_sum(expression):
+    sums = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order').annotate(sum=Sum(expression))
+    return Coalesce(Subquery(sums.values('sum')), Value(0))
+
+
+def refresh_order_totals(order_ids):
+    # one UPDATE from the stored line snapshots, the product table is never read
+    return Order.objects.filter(pk__in=order_ids).update(
+        subtotal=_order_sum('line_total'),
+        shipping_cost=_order_sum('shipping_cost'),
+        total=_order_sum(F('line_total') + F('shipping_cost')),
+    )
+
+
+def snapshot_order_items(order_ids):
+    # fills lines created before prices were snapshotted, from the product's current price
+    products = Product.objects.filter(pk=OuterRef('product_id'))
+    items = OrderItem.objects.filter(order_id__in=order_ids, unit_price__isnull=True)
+    updated = items.update(
+        unit_price=Subquery(products.values('price')),
+        discount=Subquery(products.values('discount')),
+        shipping_cost=Subquery(products.values('shipping_cost')),
+    )
+    # and recomputes the line totals stored under the older per-line rounding
+    OrderItem.objects.filter(order_id__in=order_ids).exclude(line_total=ORDER_LINE_TOTAL).update(
+        line_total=ORDER_LINE_TOTAL)
+    return updated
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class EmptyCart(CheckoutError):
+    def __init__(self):
+        super().__init__('Your cart is empty')
+
+
+class CheckoutBusy(CheckoutError):
+    def __init__(self):
+        super().__init__('These products are in high demand right now, please try again')
+
+
+class OutOfStock(CheckoutError):
+    def __init__(self, products):
+        self.products = products
+        super().__init__(f'Not enough stock for {", ".join(product.name for product in products)}')
+
+
+def checkout(order):
+    user_id = order.owner_id
+    with transaction.atomic():
+        if settings.CHECKOUT_LOCK_TIMEOUT and connection.vendor == 'postgresql':
+            # a hot product must fail fast instead of queueing every checkout behind it
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL lock_timeout = %s', [f'{settings.CHECKOUT_LOCK_TIMEOUT}ms'])
+
+        # the lock timeout covers the cart rows too, e.g. a second checkout of the same cart from another tab
+        try:
+            cart = dict(CartItem.objects.select_for_update().filter(user_id=user_id).values_list(
+                'product_id', 'quantity'))
+            if not cart:
+                raise EmptyCart
+
+            # always lock in primary key order so two overlapping carts can never deadlock
+            products = list(Product.objects.select_for_update().filter(pk__in=cart).order_by('pk').only(
+                'name', 'price', 'discount', 'effective_price', 'shipping_cost', 'quantity'))
+        except OperationalError as e:
+            raise CheckoutBusy from e
+        wanted = Case(*(When(pk=pk, then=Value(quantity)) for pk, quantity in cart.items()))
+        updated = Product.objects.filter(pk__in=cart, quantity__gte=wanted).update(quantity=F('quantity') - wanted)
+        if updated != len(cart):
+            raise OutOfStock([product for product in products if product.quantity < cart[product.pk]])
+        # the stock went through a queryset update, which sends no signals
+        transaction.on_commit(partial(bump_product_versions, list(cart)))
+
+        items = []
+        for product in products:
+            item = OrderItem(order=order, product=product, quantity=cart[product.pk])
+            item.snapshot(product)
+            items.append(item)
+        OrderItem.objects.bulk_create(items)
+
+        order.subtotal = sum(item.line_total for item in items)
+        order.shipping_cost = sum(item.shipping_cost for item in items)
+        order.total = order.subtotal + order.shipping_cost
+        order.save(update_fields=['subtotal', 'shipping_cost', 'total'])
+
+        CartItem.objects.filter(user_id=user_id).delete()
+        CartSummary.objects.filter(user_id=user_id).update(item_count=0, subtotal=0, shipping=0, total=0)
+    return order
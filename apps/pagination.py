@@ -0,0 +1,89 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from datetime import datetime
+
+from django.core.exceptions import BadRequest, ValidationError
+from django.db.models import Q
+
+
+def encode_cursor(values):
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, fields, model):
+    try:
+        values = json.loads(urlsafe_b64decode(cursor.encode()))
+    except (BinasciiError, ValueError):
+        raise BadRequest('Invalid cursor')
+    if not isinstance(values, list) or len(values) != len(fields) or None in values:
+        raise BadRequest('Invalid cursor')
+    try:
+        # well-formed but edited by hand, e.g. a string where the key is a datetime
+        return [model._meta.get_field(field).to_python(value) for field, value in zip(fields, values)]
+    except (ValidationError, TypeError):
+        raise BadRequest('Invalid cursor')
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    # seeks on an index instead of OFFSET, so page 10 000 costs the same as page 1
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.ordering = ordering
+        self.fields = [field.lstrip('-') for field in ordering]
+        self.per_page = per_page
+
+    def seek(self, values, forward):
+        lookup = Q()
+        for index, (field, order) in enumerate(zip(self.fields, self.ordering)):
+            after = order.startswith('-') != forward
+            condition = Q(**{f'{field}__{"gt" if after else "lt"}': values[index]})
+            condition &= Q(**dict(zip(self.fields[:index], values[:index])))
+            lookup |= condition
+        return lookup
+
+    def cursor(self, obj):
+        return encode_cursor([getattr(obj, field) for field in self.fields])
+
+    def page(self, after=None, before=None):
+        queryset = self.queryset.order_by(*self.ordering)
+        if before:
+            values = decode_cursor(before, self.fields, queryset.model)
+            reversed_ordering = [field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering]
+            rows = list(queryset.filter(self.seek(values, forward=False))
+                        .order_by(*reversed_ordering)[:self.per_page + 1])
+            has_more = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            return KeysetPage(rows, self.cursor(rows[-1]) if rows else None,
+                              self.cursor(rows[0]) if rows and has_more else None)
+
+        if after:
+            queryset = queryset.filter(self.seek(decode_cursor(after, self.fields, queryset.model), forward=True))
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        return KeysetPage(rows, self.cursor(rows[-1]) if has_more else None,
+                          self.cursor(rows[0]) if rows and after else None)
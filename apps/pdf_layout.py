@@ -0,0 +1,121 @@
+from collections import namedtuple
+from functools import lru_cache
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+Column = namedtuple('Column', 'title width')
+
+ELLIPSIS = '...'
+
+
+@lru_cache(maxsize=8192)
+def string_width(text, font, size):
+    return stringWidth(text, font, size)
+
+
+def fit_text(text, width, font, size):
+    if string_width(text, font, size) <= width:
+        return text
+
+    # binary search for the longest prefix that still fits with the ellipsis
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if string_width(text[:middle] + ELLIPSIS, font, size) <= width:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low] + ELLIPSIS
+
+
+class TableLayout:
+    def __init__(self, c, columns, title, pagesize=letter, margin=50, line_height=25, padding=5,
+                 font='Helvetica', bold_font='Helvetica-Bold', font_size=12, title_size=18):
+        self.c = c
+        self.columns = columns
+        self.title = title
+        self.width, self.height = pagesize
+        self.margin = margin
+        self.line_height = line_height
+        self.padding = padding
+        self.font = font
+        self.bold_font = bold_font
+        self.font_size = font_size
+        self.title_size = title_size
+        self.table_width = sum(column.width for column in columns)
+        self.page = 0
+        self.rows = 0
+        self.y = None
+
+    def start_page(self):
+        self.page += 1
+        title = self.title if self.page == 1 else f'{self.title} (continued)'
+        self.c.setFont(self.bold_font, self.title_size)
+        self.c.drawString((self.width - string_width(title, self.bold_font, self.title_size)) / 2,
+                          self.height - 40, title)
+        self.y = self.height - 100
+        self.draw_header()
+
+    def end_page(self):
+        text = f'Page {self.page}'
+        self.c.setFont(self.font, 9)
+        self.c.setFillColor(colors.grey)
+        self.c.drawString(self.width - self.margin - string_width(text, self.font, 9), self.margin / 2, text)
+        self.c.setFillColor(colors.black)
+        self.c.showPage()
+
+    def ensure_space(self, height):
+        if self.y is None:
+            self.start_page()
+        elif self.y - height < self.margin:
+            self.end_page()
+            self.start_page()
+
+    def draw_header(self):
+        self.c.setFillColor(colors.lightblue)
+        self.c.rect(self.margin, self.y, self.table_width, self.line_height, fill=1)
+        self.c.setFillColor(colors.black)
+        self.draw_cells([column.title for column in self.columns], self.bold_font)
+
+    def draw_cells(self, values, font):
+        self.c.setFont(font, self.font_size)
+        x = self.margin
+        for column, value in zip(self.columns, values):
+            text = fit_text(str(value), column.width - 2 * self.padding, font, self.font_size)
+            self.c.drawString(x + self.padding, self.y + self.padding, text)
+            self.c.rect(x, self.y, column.width, self.line_height, fill=0)
+            x += column.width
+
+    def add_row(self, values):
+        self.ensure_space(self.line_height)
+        self.y -= self.line_height
+        self.rows += 1
+
+        self.c.setFillColor(colors.whitesmoke if self.rows % 2 == 0 else colors.lightgrey)
+        self.c.rect(self.margin, self.y, self.table_width, self.line_height, fill=1)
+        self.c.setFillColor(colors.black)
+        self.draw_cells(values, self.font)
+
+    def add_summary(self, lines, total):
+        # the summary block never splits across pages
+        self.ensure_space(self.line_height * (len(lines) + 1) + 28)
+        self.c.setFont(self.font, self.font_size)
+
+        self.y -= self.line_height
+        for line in lines:
+            self.y -= self.line_height
+            self.c.drawString(self.margin, self.y, line)
+
+        self.y -= 10
+        self.c.setLineWidth(1)
+        self.c.setStrokeColor(colors.grey)
+        self.c.line(self.margin, self.y, self.margin + 120, self.y)
+
+        self.y -= 18
+        self.c.drawString(self.margin, self.y, total)
+
+    def finish(self):
+        self.ensure_space(0)
+        self.end_page()
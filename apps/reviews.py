@@ -0,0 +1,52 @@
+from collections import defaultdict
+
+from django.db import connection
+
+from apps.models import Product, Review
+from apps.models.product import RATING_SCALE
+
+_BUCKETS = range(1, RATING_SCALE + 1)
+
+
+def update_rating_stats(old=None, new=None):
+    # old and new are (product_id, rating) before and after a review write
+    deltas = defaultdict(lambda: [0] * (2 + RATING_SCALE))
+    for state, sign in ((old, -1), (new, 1)):
+        if state is not None:
+            product_id, rating = state
+            delta = deltas[product_id]
+            delta[0] += sign
+            delta[1] += sign * rating
+            delta[1 + rating] += sign
+
+    changes = [(product_id, *delta) for product_id, delta in deltas.items() if any(delta)]
+    if not changes:
+        return
+    table = connection.ops.quote_name(Product._meta.db_table)
+    placeholders = ', '.join(['%s::integer'] * (3 + RATING_SCALE))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {table} AS product SET rating_count = product.rating_count + changes.count, '
+            f'rating_sum = product.rating_sum + changes.sum, '
+            f'rating_histogram = ARRAY[{", ".join(f"product.rating_histogram[{i}] + changes.r{i}" for i in _BUCKETS)}] '
+            f'FROM (VALUES {", ".join([f"({placeholders})"] * len(changes))}) '
+            f'AS changes (product_id, count, sum, {", ".join(f"r{i}" for i in _BUCKETS)}) '
+            f'WHERE product.id = changes.product_id',
+            [value for change in changes for value in change],
+        )
+
+
+def rebuild_rating_stats():
+    table = connection.ops.quote_name(Product._meta.db_table)
+    reviews = connection.ops.quote_name(Review._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {table} AS product SET rating_count = totals.count, rating_sum = totals.sum, '
+            f'rating_histogram = totals.histogram '
+            f'FROM (SELECT node.id, COUNT(review.id) AS count, COALESCE(SUM(review.rating), 0) AS sum, '
+            f'ARRAY[{", ".join(f"COUNT(review.id) FILTER (WHERE review.rating = {i})" for i in _BUCKETS)}] '
+            f'AS histogram FROM {table} AS node LEFT JOIN {reviews} AS review ON review.product_id = node.id '
+            f'GROUP BY node.id) AS totals '
+            f'WHERE product.id = totals.id',
+        )
+        return cursor.rowcount
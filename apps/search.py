@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordDistance, TrigramWordSimilarity
+from django.db.models import F
+
+from apps.models.product import SEARCH_CONFIG
+
+
+def search_products(queryset, text):
+    # returns (results, fuzzy); fuzzy is True when the results come from the trigram fallback
+    query = SearchQuery(text, search_type='websearch', config=SEARCH_CONFIG)
+    rank = SearchRank(F('search_vector'), query)
+    # ts_rank reads the vector of every row it ranks, so it only sees a bounded, unordered set of index matches
+    # from the filtered queryset; a query matching more than SEARCH_RANK_CANDIDATES rows ranks a subset of them
+    candidates = queryset.filter(search_vector=query).order_by().values('pk')[:settings.SEARCH_RANK_CANDIDATES]
+    matches = list(queryset.model._default_manager.filter(pk__in=candidates).annotate(rank=rank).order_by(
+        '-rank', '-pk').values_list('pk', flat=True)[:settings.SEARCH_MAX_RESULTS])
+    if matches:
+        return queryset.filter(pk__in=matches).annotate(rank=rank).order_by('-rank', '-pk'), False
+
+    # nothing matched as words, so look for names that are spelled close to the text; ordering by the
+    # distance operator alone lets the GiST index return the nearest names first and stop at the limit
+    similar = list(queryset.filter(name__trigram_word_similar=text).annotate(
+        distance=TrigramWordDistance(text, 'name')).order_by('distance').values_list(
+        'pk', flat=True)[:settings.SEARCH_FUZZY_MAX_RESULTS])
+    return queryset.filter(pk__in=similar).annotate(
+        rank=TrigramWordSimilarity(text, 'name')).order_by('-rank', '-pk'), True
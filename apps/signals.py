@@ -0,0 +1,138 @@
+from functools import partial
+
+from django.db import transaction, connections
+from django.db.models.signals import post_save, post_delete, pre_migrate, pre_save, pre_delete
+from django.dispatch import receiver
+from mptt.signals import node_moved
+
+from apps.cache import bump_category_tree_version, bump_product_versions, bump_tags_version
+from apps.cart import rebuild_cart_summaries
+from apps.facets import update_facet_counts, update_category_counts, rebuild_category_counts
+from apps.orders import refresh_order_totals
+from apps.reviews import update_rating_stats
+from apps.models import Category, Product, CartItem, Order, OrderItem, ProductImage, Review, Tag
+from apps.tasks import schedule_order_pdf, schedule_thumbnails
+
+
+@receiver(pre_migrate)
+def install_extensions(sender, using, **kwargs):
+    # the trigram index on Product.name needs pg_trgm before the apps migrations run
+    connection = connections[using]
+    if sender.name == 'apps' and connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+
+@receiver([post_save, post_delete, node_moved], sender=Category)
+def category_changed(sender, **kwargs):
+    transaction.on_commit(bump_category_tree_version)
+
+
+@receiver(node_moved, sender=Category)
+def category_moved(sender, **kwargs):
+    # the old ancestors are gone from the tree by now; moves are rare enough to recount everything
+    rebuild_category_counts()
+
+
+@receiver(post_save, sender=Product)
+def product_repriced(sender, instance, created, **kwargs):
+    if not created:
+        rebuild_cart_summaries(user_ids=CartItem.objects.filter(product=instance).values('user_id'))
+
+
+@receiver(pre_delete, sender=Product)
+def product_before_delete(sender, instance, **kwargs):
+    # the cascade takes the cart rows with the product, without signals of their own
+    instance._cart_user_ids = list(CartItem.objects.filter(product=instance).values_list('user_id', flat=True))
+
+
+@receiver(post_delete, sender=Product)
+def product_removed_from_carts(sender, instance, **kwargs):
+    user_ids = getattr(instance, '_cart_user_ids', None)
+    if user_ids:
+        rebuild_cart_summaries(user_ids=user_ids)
+
+
+@receiver(pre_save, sender=Product)
+def product_before_save(sender, instance, raw, **kwargs):
+    instance._stored_state = None
+    if instance.pk and not raw:
+        instance._stored_state = Product.objects.filter(pk=instance.pk).values_list(
+            'category_id', 'specifications').first()
+
+
+@receiver(post_save, sender=Product)
+def product_counts_saved(sender, instance, raw, **kwargs):
+    if raw:
+        return
+    before = getattr(instance, '_stored_state', None)
+    update_facet_counts(before, (instance.category_id, instance.specifications))
+    if before is None or before[0] != instance.category_id:
+        update_category_counts([(before and before[0], -1), (instance.category_id, 1)])
+
+
+@receiver(post_delete, sender=Product)
+def product_counts_deleted(sender, instance, **kwargs):
+    update_facet_counts((instance.category_id, instance.specifications), None)
+    update_category_counts([(instance.category_id, -1)])
+
+
+@receiver([post_save, post_delete], sender=Product)
+def product_page_changed(sender, instance, **kwargs):
+    transaction.on_commit(partial(bump_product_versions, [instance.pk]))
+
+
+@receiver([post_save, post_delete], sender=ProductImage)
+@receiver([post_save, post_delete], sender=Review)
+def product_related_changed(sender, instance, **kwargs):
+    transaction.on_commit(partial(bump_product_versions, [instance.product_id]))
+
+
+@receiver(pre_save, sender=ProductImage)
+def product_image_before_save(sender, instance, raw, **kwargs):
+    instance._image_changed = not raw and bool(instance.image) and (
+        not instance.pk or not ProductImage.objects.filter(pk=instance.pk, image=instance.image.name).exists())
+    if instance._image_changed:
+        # the old variants belong to the old file
+        instance.thumbnail_widths = []
+
+
+@receiver(post_save, sender=ProductImage)
+def product_image_saved(sender, instance, **kwargs):
+    if getattr(instance, '_image_changed', False):
+        schedule_thumbnails(instance.pk)
+
+
+@receiver(pre_save, sender=Review)
+def review_before_save(sender, instance, raw, **kwargs):
+    instance._stored_rating = None
+    if instance.pk and not raw:
+        instance._stored_rating = Review.objects.filter(pk=instance.pk).values_list('product_id', 'rating').first()
+
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, raw, **kwargs):
+    if not raw:
+        update_rating_stats(getattr(instance, '_stored_rating', None), (instance.product_id, instance.rating))
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    update_rating_stats((instance.product_id, instance.rating), None)
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def tag_changed(sender, **kwargs):
+    transaction.on_commit(bump_tags_version)
+
+
+@receiver(post_save, sender=Order)
+def order_created(sender, instance, created, **kwargs):
+    if created:
+        schedule_order_pdf(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=OrderItem)
+def order_item_changed(sender, instance, **kwargs):
+    refresh_order_totals([instance.order_id])
+    schedule_order_pdf(instance.order_id)
@@ -1,12 +1,58 @@
 from celery import shared_task
-from django.core.mail import send_mail
+from django.core.cache import cache
+from django.db import transaction
 
+from apps.cache import bump_product_versions
+from apps.generate_pdf import make_pdf
+from apps.mail import queue_email, send_queued_emails
+from apps.models import Order, ProductImage
+from apps.thumbnails import make_variants
 from root import settings
 
 
 @shared_task
 def send_to_email(msg: str, email: str):
-    subject = 'Tema'
-    send_mail(subject, msg, settings.EMAIL_HOST_USER, [email])
+    queue_email(email, 'Tema', msg)
 
 
+@shared_task(ignore_result=True)
+def drain_email_queue():
+    # run by beat; keeps taking batches until the queue is empty or the minute's budget is spent,
+    # and stops at a batch where nothing went out: the server is likely down, the next beat tries again
+    while True:
+        sent, _ = send_queued_emails()
+        if not sent:
+            break
+
+
+def order_pdf_queued_key(order_id, pdf_hash=None):
+    if pdf_hash is None:
+        return f'order_pdf_queued:{order_id}'
+    return f'order_pdf_queued:{order_id}:{pdf_hash}'
+
+
+def schedule_order_pdf(order_id, pdf_hash=None):
+    # one queued render per order at a time; the task clears the flag before it reads the order.
+    # A download names the content it waits for: that flag outlives the render, so polls never queue it again
+    if cache.add(order_pdf_queued_key(order_id, pdf_hash), True, settings.ORDER_PDF_QUEUE_TIMEOUT):
+        transaction.on_commit(lambda: render_order_pdf.delay(order_id))
+
+
+@shared_task
+def render_order_pdf(order_id: int):
+    cache.delete(order_pdf_queued_key(order_id))
+    order = Order.objects.filter(pk=order_id).first()
+    if order is not None:
+        make_pdf(order)
+
+
+def schedule_thumbnails(image_id):
+    transaction.on_commit(lambda: make_thumbnails.delay(image_id))
+
+
+@shared_task
+def make_thumbnails(image_id: int, force: bool = False):
+    image = ProductImage.objects.filter(pk=image_id).first()
+    if image is not None and image.image:
+        make_variants(image, force=force)
+        bump_product_versions([image.product_id])
@@ -1,6 +1,12 @@
 from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.utils.safestring import mark_safe
 
-from apps.models.product import Favorite
+from apps.cache import CATEGORY_SIDEBAR_PLACEHOLDER, get_category_sidebar, record_cache_lookup
+from apps.db.router import read_from_default
+from apps.thumbnails import variant_url
 
 register = template.Library()
 
@@ -18,10 +24,74 @@ def str_to_phone(value, arg=None):
 
 
 @register.filter()
-def is_liked(user, product) -> bool:
-    return Favorite.objects.filter(user=user, product=product).exists()
+def payable_total(sub_total, shipping_cost):
+    return sub_total + shipping_cost
+
+
+@register.simple_tag(takes_context=True)
+def category_sidebar(context):
+    # a page cached for everyone leaves a marker, the sidebar is put in when the page is served
+    if context.get('defer_category_sidebar'):
+        return mark_safe(CATEGORY_SIDEBAR_PLACEHOLDER)
+    return get_category_sidebar()
+
+
+@register.simple_tag(takes_context=True)
+def url_replace(context, **kwargs):
+    # current query string with the given parameters swapped, so paging keeps the search and filters;
+    # an empty value drops the parameter
+    query = context['request'].GET.copy()
+    for key, value in kwargs.items():
+        if value in (None, ''):
+            query.pop(key, None)
+        else:
+            query[key] = value
+    return query.urlencode()
+
+
+@register.simple_tag()
+def srcset(product_image, image_format='jpeg'):
+    if not product_image:
+        return ''
+    return ', '.join(f'{variant_url(product_image, width, image_format)} {width}w'
+                     for width in product_image.thumbnail_widths)
 
 
 @register.filter()
-def payable_total(sub_total, shipping_cost):
-    return sub_total + shipping_cost
+def thumbnail_url(product_image, width):
+    # the smallest variant at least this wide; the original until the variants exist
+    if not product_image or not product_image.image:
+        return ''
+    widths = product_image.thumbnail_widths
+    if not widths:
+        return product_image.image.url
+    return variant_url(product_image, next((w for w in widths if w >= int(width)), widths[-1]))
+
+
+class CachedFragmentNode(template.Node):
+    def __init__(self, nodelist, name, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.vary_on = vary_on
+
+    def render(self, context):
+        key = make_template_fragment_key(self.name, [var.resolve(context) for var in self.vary_on])
+        html = cache.get(key)
+        record_cache_lookup(f'fragment:{self.name}', html is not None)
+        if html is None:
+            # stored under the current version: its lazy querysets read default, not a lagging replica
+            with read_from_default():
+                html = self.nodelist.render(context)
+            cache.set(key, html, settings.FRAGMENT_CACHE_TIMEOUT)
+        return html
+
+
+@register.tag()
+def cached_fragment(parser, token):
+    # {% cached_fragment name vary_on... %}: like {% cache %}, plus hit/miss counts per fragment name
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' tag requires a fragment name")
+    nodelist = parser.parse(('endcached_fragment',))
+    parser.delete_first_token()
+    return CachedFragmentNode(nodelist, bits[1], [parser.compile_filter(bit) for bit in bits[2:]])
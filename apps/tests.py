@@ -1,3 +1,644 @@
-from django.test import TestCase
+from datetime import timedelta
+from smtplib import SMTPException
+from threading import Barrier, Event, Thread
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core import mail
+from django.core.exceptions import BadRequest
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import DEFAULT_DB_ALIAS, connection, connections, router, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.timezone import now
+
+from apps.cache import CATEGORY_SIDEBAR_PLACEHOLDER, bump_category_tree_version, get_category_tree, \
+    get_category_tree_version
+from apps.cart import add_to_cart, cart_totals, rebuild_cart_summaries, remove_from_cart, set_cart_quantity
+from apps.db.router import read_from_replica
+from apps.facets import rebuild_category_counts
+from apps.mail import queue_email, send_queued_emails
+from apps.models import Address, Category, CartItem, CartSummary, Favorite, Order, OrderItem, OutgoingEmail, Product, \
+    User
+from apps.models.base import allocate_slugs
+from apps.orders import CheckoutBusy, CheckoutError, EmptyCart, OutOfStock, checkout
+from apps.pagination import KeysetPaginator, encode_cursor
+from apps.search import search_products
+from apps.views import ProductListView
+
+REPLICA = 'replica_1'
+
+
+def create_products(count):
+    category = Category.objects.create(name='Phones')
+    return [
+        Product.objects.create(name=f'Phone {i}', price=100 + i, quantity=5, shipping_cost=0, short_description='',
+                               description='', specifications={'color': 'black'}, category=category)
+        for i in range(count)
+    ]
+
+
+def create_buyer(username='buyer'):
+    user = User.objects.create_user(username, password='secret')
+    address = Address.objects.create(user=user, full_name='Buyer', street='Main 1', zip_code=100000,
+                                     city='Tashkent', phone='901234567')
+    return user, address
+
+
+def place_order(user, address):
+    # what OrderCreateView does: the order and the checkout commit or roll back together
+    with transaction.atomic():
+        return checkout(Order.objects.create(owner=user, address=address, payment_method='paypal'))
+
+
+@override_settings(QUERY_BUDGET_ENFORCE=True)
+class QueryBudgetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_products(8)
+
+    def query_count(self, page_size):
+        with mock.patch.object(ProductListView, 'paginate_by', page_size):
+            response = self.client.get(reverse('product_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['products']), page_size)
+        return int(response['X-Query-Count'])
+
+    def test_product_list_queries_do_not_grow_with_page_size(self):
+        self.query_count(2)  # fills the category tree and version caches
+        self.assertEqual(self.query_count(2), self.query_count(6))
+
+
+class KeysetPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_products(5)
+
+    def names(self, page):
+        return [product.name for product in page]
+
+    def paginate(self, ordering):
+        return KeysetPaginator(Product.objects.all(), ordering, 2)
+
+    def test_after_and_before_round_trip(self):
+        paginator = self.paginate(('effective_price', 'id'))
+        first = paginator.page()
+        self.assertEqual(self.names(first), ['Phone 0', 'Phone 1'])
+        self.assertFalse(first.has_previous())
+
+        second = paginator.page(after=first.next_cursor)
+        self.assertEqual(self.names(second), ['Phone 2', 'Phone 3'])
+        last = paginator.page(after=second.next_cursor)
+        self.assertEqual(self.names(last), ['Phone 4'])
+        self.assertFalse(last.has_next())
+
+        back = paginator.page(before=last.previous_cursor)
+        self.assertEqual(self.names(back), ['Phone 2', 'Phone 3'])
+        self.assertEqual(self.names(paginator.page(before=back.previous_cursor)), ['Phone 0', 'Phone 1'])
+        self.assertFalse(paginator.page(before=back.previous_cursor).has_previous())
+
+    def test_descending_datetime_key(self):
+        paginator = self.paginate(('-created_at', '-id'))
+        first = paginator.page()
+        self.assertEqual(self.names(first), ['Phone 4', 'Phone 3'])
+        second = paginator.page(after=first.next_cursor)
+        self.assertEqual(self.names(second), ['Phone 2', 'Phone 1'])
+        self.assertEqual(self.names(paginator.page(before=second.previous_cursor)), ['Phone 4', 'Phone 3'])
+
+    def test_bad_cursors(self):
+        paginator = self.paginate(('-created_at', '-id'))
+        for cursor in ['not a cursor!', encode_cursor(['x', 1]), encode_cursor([1, 1]), encode_cursor([1]),
+                       encode_cursor([None, 1]), encode_cursor({'created_at': 1})]:
+            with self.subTest(cursor=cursor), self.assertRaises(BadRequest):
+                paginator.page(after=cursor)
+            with self.subTest(cursor=cursor), self.assertRaises(BadRequest):
+                paginator.page(before=cursor)
+
+    def test_bad_cursor_is_a_bad_request(self):
+        response = self.client.get(reverse('category_products', args=['phones']),
+                                   {'after': encode_cursor(['x', 1])})
+        self.assertEqual(response.status_code, 400)
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_products(3)
+
+    def search(self, text, queryset=None):
+        results, fuzzy = search_products(Product.objects.all() if queryset is None else queryset, text)
+        return sorted(product.name for product in results), fuzzy
+
+    def test_words(self):
+        self.assertEqual(self.search('phones'), (['Phone 0', 'Phone 1', 'Phone 2'], False))
+
+    def test_typo_falls_back_to_trigrams(self):
+        self.assertEqual(self.search('phne'), (['Phone 0', 'Phone 1', 'Phone 2'], True))
+
+    @override_settings(SEARCH_RANK_CANDIDATES=1)
+    def test_candidates_come_from_the_filtered_queryset(self):
+        self.assertEqual(self.search('phone', Product.objects.filter(price__gte=102)), (['Phone 2'], False))
+        self.assertEqual(self.search('phne', Product.objects.filter(price__gte=102)), (['Phone 2'], True))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CategoryCountTests(TestCase):
+    def counts(self):
+        return {node.name: node.product_count for node in get_category_tree()}
+
+    def test_product_writes_keep_the_tree_version(self):
+        phones = create_products(1)[0].category
+        version = get_category_tree_version()
+        self.assertEqual(self.counts(), {'Phones': 1})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name='Phone X', price=100, quantity=5, shipping_cost=0, short_description='',
+                                   description='', specifications={}, category=phones)
+        self.assertEqual(get_category_tree_version(), version)
+        # the stored count is current, the tree shows it once the cached counts expire
+        self.assertEqual(Category.objects.get(pk=phones.pk).product_count, 2)
+        self.assertEqual(self.counts(), {'Phones': 1})
+        cache.clear()
+        self.assertEqual(self.counts(), {'Phones': 2})
+
+    def test_rebuild_refreshes_the_counts(self):
+        phones = create_products(2)[0].category
+        self.assertEqual(self.counts(), {'Phones': 2})
+        Category.objects.filter(pk=phones.pk).update(product_count=0)
+        with self.captureOnCommitCallbacks(execute=True):
+            rebuild_category_counts()
+        self.assertEqual(self.counts(), {'Phones': 2})
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ProductPageCacheTests(TestCase):
+    def get_page(self, product):
+        response = self.client.get(reverse('product_detail', args=[product.pk]))
+        self.assertEqual(response.status_code, 200)
+        # the cached page carries a marker, every response carries the sidebar
+        self.assertNotContains(response, CATEGORY_SIDEBAR_PLACEHOLDER)
+        self.assertContains(response, 'navbarVerticalNav')
+        return response['X-Cache']
+
+    def test_saving_one_product_keeps_the_other_pages(self):
+        product_a, product_b = create_products(2)
+        for product in (product_a, product_b):
+            self.assertEqual(self.get_page(product), 'MISS')
+            self.assertEqual(self.get_page(product), 'HIT')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product_a.name = 'Phone A'
+            product_a.save()
+            # a new product changes the category counts in the sidebar
+            Product.objects.create(name='Phone X', price=100, quantity=5, shipping_cost=0, short_description='',
+                                   description='', specifications={}, category=product_a.category)
+        self.assertEqual(self.get_page(product_b), 'HIT')
+        self.assertEqual(self.get_page(product_a), 'MISS')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product_b.save()
+        self.assertEqual(self.get_page(product_b), 'MISS')
+
+    def test_likes_keep_the_page(self):
+        product = create_products(1)[0]
+        user, _ = create_buyer()
+        self.assertEqual(self.get_page(product), 'MISS')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=user, product=product).delete()
+        self.assertEqual(self.get_page(product), 'HIT')
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', EMAIL_RATE_LIMIT=0,
+                   EMAIL_MAX_ATTEMPTS=3, EMAIL_RETRY_BACKOFF=60, EMAIL_RETRY_MAX_DELAY=60 * 60)
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   ORDER_PDF_INLINE_MAX_LINES=0)
+class OrderPdfViewTests(TestCase):
+    def test_polling_queues_one_render(self):
+        user, address = create_buyer()
+        add_to_cart(user.pk, create_products(1)[0])
+        order = place_order(user, address)
+        self.client.force_login(user)
+
+        with mock.patch('apps.tasks.render_order_pdf.delay') as delay, self.captureOnCommitCallbacks(execute=True):
+            for _ in range(3):
+                response = self.client.get(reverse('download_pdf', args=[order.pk]))
+                self.assertEqual(response.status_code, 202)
+        delay.assert_called_once_with(order.pk)
+
+
+class EmailQueueTests(TestCase):
+    def queue(self, count, **fields):
+        emails = [queue_email(f'user{i}@example.com', f'Subject {i}', 'Body') for i in range(count)]
+        OutgoingEmail.objects.filter(pk__in=[email.pk for email in emails]).update(**fields)
+        return emails
+
+    def pending(self):
+        return OutgoingEmail.objects.filter(status=OutgoingEmail.Status.PENDING)
+
+    def test_batches(self):
+        self.queue(5)
+        self.assertEqual(send_queued_emails(batch_size=2), (2, 0))
+        self.assertEqual([message.to for message in mail.outbox], [['user0@example.com'], ['user1@example.com']])
+        self.assertEqual(self.pending().count(), 3)
+        self.assertEqual(send_queued_emails(batch_size=10), (3, 0))
+        self.assertEqual(send_queued_emails(batch_size=10), (0, 0))
+        self.assertEqual(len(mail.outbox), 5)
+
+    @override_settings(EMAIL_RATE_LIMIT=3)
+    def test_rate_limit(self):
+        self.queue(5)
+        self.assertEqual(send_queued_emails(batch_size=10), (3, 0))
+        # the minute's budget is spent until the sends age out of it
+        self.assertEqual(send_queued_emails(batch_size=10), (0, 0))
+        OutgoingEmail.objects.filter(status=OutgoingEmail.Status.SENT).update(sent_at=now() - timedelta(minutes=2))
+        self.assertEqual(send_queued_emails(batch_size=10), (2, 0))
+
+    def test_failed_send_backs_off(self):
+        self.queue(1, attempts=1)
+        with mock.patch.object(EmailBackend, 'send_messages', side_effect=SMTPException('mailbox full')):
+            self.assertEqual(send_queued_emails(), (0, 1))
+        email = OutgoingEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), (OutgoingEmail.Status.PENDING, 2))
+        self.assertEqual(email.last_error, 'SMTPException: mailbox full')
+        # the second attempt waits twice the base backoff
+        self.assertAlmostEqual((email.send_after - now()).total_seconds(), 120, delta=5)
+        self.assertEqual(send_queued_emails(), (0, 0))
+
+    def test_gives_up_after_max_attempts(self):
+        self.queue(1, attempts=2)
+        with mock.patch.object(EmailBackend, 'send_messages', side_effect=SMTPException('mailbox full')):
+            self.assertEqual(send_queued_emails(), (0, 1))
+        email = OutgoingEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), (OutgoingEmail.Status.FAILED, 3))
+
+    def test_unreachable_server_pushes_the_batch_back(self):
+        self.queue(3)
+        with mock.patch.object(EmailBackend, 'open', side_effect=ConnectionRefusedError('refused')):
+            self.assertEqual(send_queued_emails(), (0, 3))
+        self.assertEqual(mail.outbox, [])
+        for email in self.pending():
+            self.assertEqual(email.attempts, 0)
+            self.assertGreater(email.send_after, now() + timedelta(seconds=50))
+            self.assertIn('ConnectionRefusedError', email.last_error)
+        self.assertEqual(send_queued_emails(), (0, 0))
+
+
+class FavouriteViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', password='secret')
+        other = User.objects.create_user('other', password='secret')
+        products = create_products(3)
+        for product in products[:2]:
+            Favorite.objects.create(user=cls.user, product=product)
+        for product in products:
+            Favorite.objects.create(user=other, product=product)
+
+    def test_needs_login(self):
+        response = self.client.get(reverse('favorites_page'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_lists_only_the_users_own_favourites(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('favorites_page'))
+        self.assertEqual([favourite.user_id for favourite in response.context['favourites']], [self.user.pk] * 2)
+        self.assertEqual([favourite.product.name for favourite in response.context['favourites']],
+                         ['Phone 1', 'Phone 0'])
+
+
+class SlugTests(TestCase):
+    @staticmethod
+    def category(name, parent=None):
+        return Category(name=name, parent=parent)
+
+    def test_collisions_inside_one_batch(self):
+        categories = Category.bulk_create_with_slugs([self.category('Phones'), self.category('phones'),
+                                                      self.category('Phones!'), self.category('Tablets')])
+        self.assertEqual([category.slug for category in categories], ['phones', 'phones-1', 'phones-2', 'tablets'])
+
+    def test_bulk_created_categories_form_a_tree(self):
+        [root] = Category.bulk_create_with_slugs([self.category('Electronics')])
+        children = Category.bulk_create_with_slugs([self.category('Phones', root), self.category('Tablets', root)])
+        self.assertEqual([(child.level, child.tree_id) for child in children], [(1, root.tree_id)] * 2)
+        root.refresh_from_db()
+        self.assertEqual([node.name for node in root.get_descendants()], ['Phones', 'Tablets'])
+
+    def test_collisions_with_existing_rows(self):
+        Category.objects.create(name='Phones')
+        Category.objects.create(name='Phones 7')
+        # numbering carries on after the highest suffix taken
+        self.assertEqual(allocate_slugs(Category, ['Phones', 'Phones', 'Laptops']), ['phones-8', 'phones-9', 'laptops'])
+        categories = Category.bulk_create_with_slugs([self.category('Phones'), self.category('Laptops')])
+        self.assertEqual([category.slug for category in categories], ['phones-8', 'laptops'])
+
+    def test_save_keeps_a_matching_slug(self):
+        category = Category.objects.create(name='Phones')
+        category.save()
+        self.assertEqual(category.slug, 'phones')
+
+    def test_renaming_with_update_fields_writes_the_slug(self):
+        category = Category.objects.create(name='Phones')
+        category.name = 'Tablets'
+        category.save(update_fields=['name'])
+        category.refresh_from_db()
+        self.assertEqual((category.name, category.slug), ('Tablets', 'tablets'))
+
+    def test_save_retries_a_slug_taken_after_the_lookup(self):
+        Category.objects.create(name='Phones')
+        category = Category(name='Phones')
+        # the first lookup misses the concurrent row, the retry sees it
+        with mock.patch('apps.models.base.allocate_slugs', side_effect=[['phones'], ['phones-1']]):
+            category.save()
+        self.assertEqual(category.slug, 'phones-1')
+
+
+class CartSummaryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', password='secret')
+        phone, tablet = create_products(2)
+        Product.objects.filter(pk=tablet.pk).update(shipping_cost=7)
+
+    def setUp(self):
+        # effective_price is computed by the database, so read the products back
+        self.phone, self.tablet = Product.objects.order_by('pk')
+
+    def assertSummaryMatchesCart(self, item_count, subtotal, shipping):
+        summary = CartSummary.objects.get(user=self.user)
+        self.assertEqual((summary.item_count, summary.subtotal, summary.shipping, summary.total),
+                         (item_count, subtotal, shipping, subtotal + shipping))
+        self.assertEqual(cart_totals(CartItem.objects.filter(user=self.user)),
+                         {'item_count': item_count, 'subtotal': subtotal, 'shipping': shipping})
+
+    def test_add(self):
+        add_to_cart(self.user.pk, self.phone)
+        add_to_cart(self.user.pk, self.phone, 2)
+        add_to_cart(self.user.pk, self.tablet)
+        self.assertSummaryMatchesCart(4, 3 * 100 + 101, 7)
+
+    def test_failed_summary_update_rolls_back_the_add(self):
+        with mock.patch('apps.cart.update_cart_summary_many', side_effect=RuntimeError), \
+                self.assertRaises(RuntimeError):
+            add_to_cart(self.user.pk, self.phone)
+        self.assertFalse(CartItem.objects.filter(user=self.user).exists())
+
+    def test_update_quantity(self):
+        add_to_cart(self.user.pk, self.tablet)
+        item = CartItem.objects.get(user=self.user)
+        set_cart_quantity(self.user.pk, item.pk, 5)
+        set_cart_quantity(self.user.pk, item.pk, 3)
+        self.assertSummaryMatchesCart(3, 3 * 101, 7)
+
+    def test_update_quantity_of_another_users_item(self):
+        add_to_cart(self.user.pk, self.phone)
+        other = User.objects.create_user('other', password='secret')
+        with self.assertRaises(CartItem.DoesNotExist):
+            set_cart_quantity(other.pk, CartItem.objects.get(user=self.user).pk, 5)
+
+    def test_update_quantity_view(self):
+        add_to_cart(self.user.pk, self.phone)
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('update_quantity', args=[CartItem.objects.get(user=self.user).pk]),
+                                    {'quantity': 4})
+        self.assertEqual(response.json(), {'new_quantity': 4, 'total_sum': 400, 'total_count': 4})
+        self.assertSummaryMatchesCart(4, 400, 0)
+
+    def test_remove(self):
+        add_to_cart(self.user.pk, self.phone, 2)
+        add_to_cart(self.user.pk, self.tablet)
+        item = CartItem.objects.get(user=self.user, product=self.tablet)
+        self.assertEqual(remove_from_cart(self.user.pk, item.pk).quantity, 1)
+        # a second remove of the same row changes nothing
+        self.assertIsNone(remove_from_cart(self.user.pk, item.pk))
+        self.assertSummaryMatchesCart(2, 200, 0)
+
+    def test_deleting_a_product_in_the_cart(self):
+        add_to_cart(self.user.pk, self.phone, 2)
+        add_to_cart(self.user.pk, self.tablet)
+        self.phone.delete()
+        self.assertSummaryMatchesCart(1, 101, 7)
+        self.tablet.delete()
+        self.assertSummaryMatchesCart(0, 0, 0)
+
+    def test_reprice_then_rebuild(self):
+        add_to_cart(self.user.pk, self.phone, 2)
+        self.phone.discount = 50
+        self.phone.save()  # the signal rebuilds the carts holding the product
+        self.assertSummaryMatchesCart(2, 100, 0)
+
+        # a price written around the signals is picked up by the next rebuild
+        Product.objects.filter(pk=self.phone.pk).update(price=300)
+        self.assertEqual(rebuild_cart_summaries(), (1, 0))
+        self.assertSummaryMatchesCart(2, 300, 0)
+
+
+class CheckoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.address = create_buyer()
+        cls.phone, cls.tablet = create_products(2)
+        Product.objects.filter(pk=cls.tablet.pk).update(quantity=1)
+
+    def stock(self):
+        return list(Product.objects.order_by('pk').values_list('quantity', flat=True))
+
+    def test_short_stock_rolls_back_the_order(self):
+        add_to_cart(self.user.pk, self.phone, 2)
+        add_to_cart(self.user.pk, self.tablet, 3)
+        with self.assertRaises(OutOfStock) as raised:
+            place_order(self.user, self.address)
+        self.assertEqual([product.pk for product in raised.exception.products], [self.tablet.pk])
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+        self.assertEqual(self.stock(), [5, 1])
+        # the cart is kept for the customer to fix
+        self.assertEqual(CartItem.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(CartSummary.objects.get(user=self.user).item_count, 5)
+
+    def test_empty_cart(self):
+        with self.assertRaises(EmptyCart):
+            place_order(self.user, self.address)
+        self.assertFalse(Order.objects.exists())
+
+    def test_stock_is_taken_once_per_line(self):
+        add_to_cart(self.user.pk, self.phone, 2)
+        add_to_cart(self.user.pk, self.tablet)
+        order = place_order(self.user, self.address)
+
+        self.assertEqual(self.stock(), [3, 0])
+        self.assertEqual(sorted(order.order_items.values_list('product_id', 'quantity')),
+                         [(self.phone.pk, 2), (self.tablet.pk, 1)])
+        order.refresh_from_db()
+        self.assertEqual((order.subtotal, order.total), (2 * 100 + 101, 2 * 100 + 101))
+        self.assertFalse(CartItem.objects.filter(user=self.user).exists())
+        self.assertEqual(CartSummary.objects.get(user=self.user).item_count, 0)
+
+    def test_view_reports_short_stock(self):
+        add_to_cart(self.user.pk, self.tablet, 2)
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('order_create'), {'payment_method': 'paypal', 'address': self.address.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Not enough stock for Phone 1', response.context['form'].non_field_errors())
+        self.assertFalse(Order.objects.exists())
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    def test_two_checkouts_for_the_last_item(self):
+        product = create_products(1)[0]
+        Product.objects.filter(pk=product.pk).update(quantity=1)
+        buyers = [create_buyer(f'buyer{i}') for i in range(2)]
+        for user, _ in buyers:
+            add_to_cart(user.pk, product)
+
+        barrier, results = Barrier(len(buyers), timeout=10), []
+
+        def buy(user, address):
+            try:
+                barrier.wait()
+                place_order(user, address)
+                results.append('ordered')
+            except CheckoutError as e:
+                results.append(type(e).__name__)
+            finally:
+                connection.close()
+
+        with mock.patch('apps.tasks.render_order_pdf.delay'):
+            threads = [Thread(target=buy, args=buyer) for buyer in buyers]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(sorted(results), ['OutOfStock', 'ordered'])
+        self.assertEqual(Product.objects.get(pk=product.pk).quantity, 0)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(CartItem.objects.count(), 1)
+
+    @override_settings(CHECKOUT_LOCK_TIMEOUT=100)
+    def test_locked_cart_fails_fast(self):
+        product = create_products(1)[0]
+        user, address = create_buyer()
+        add_to_cart(user.pk, product)
+        locked, release = Event(), Event()
+
+        def hold_cart():
+            # another checkout of the same cart, still inside its transaction
+            try:
+                with transaction.atomic():
+                    list(CartItem.objects.select_for_update().filter(user=user))
+                    locked.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        holder = Thread(target=hold_cart)
+        holder.start()
+        try:
+            self.assertTrue(locked.wait(10))
+            with self.assertRaises(CheckoutBusy):
+                place_order(user, address)
+
+            self.client.force_login(user)
+            response = self.client.post(reverse('order_create'), {'payment_method': 'paypal', 'address': address.pk})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context['form'].non_field_errors(), [str(CheckoutBusy())])
+        finally:
+            release.set()
+            holder.join()
+
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Product.objects.get(pk=product.pk).quantity, 5)
+
+
+@override_settings(REPLICA_DATABASES=[REPLICA])
+class ReplicaRoutingTests(TransactionTestCase):
+    # committed rows: the replica alias has its own connection to the test database; '__all__' resolves once
+    # setUpClass has added it, the test runner only knows the aliases in settings
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        # a replica the way settings.py adds one for DB_REPLICA_HOSTS, mirroring the test database
+        connections.settings[REPLICA] = {**connections[DEFAULT_DB_ALIAS].settings_dict,
+                                         'TEST': {'MIRROR': DEFAULT_DB_ALIAS}}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[REPLICA].close()
+        del connections[REPLICA]
+        del connections.settings[REPLICA]
+
+    def setUp(self):
+        self.product = create_products(1)[0]
+        self.user = User.objects.create_user('buyer', password='secret')
+
+    def aliases_read(self, response):
+        return set(response.wsgi_request.db_queries)
+
+    def test_reads_outside_read_from_replica_go_to_default(self):
+        self.assertEqual(router.db_for_read(Product), DEFAULT_DB_ALIAS)
+        with read_from_replica():
+            self.assertEqual(router.db_for_read(Product), REPLICA)
+            self.assertEqual(router.db_for_write(Product), DEFAULT_DB_ALIAS)
+        self.assertEqual(Product.objects.all().db, DEFAULT_DB_ALIAS)
+
+    def test_catalog_reads_from_the_replica(self):
+        response = self.client.get(reverse('product_list'))
+        self.assertIn(REPLICA, self.aliases_read(response))
+        self.assertNotIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+
+    def test_write_pins_the_client(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('cart_add', args=[self.product.pk]))
+        self.assertEqual(response.cookies[settings.REPLICA_PIN_COOKIE].value, '1')
+
+    def test_pinned_client_reads_default(self):
+        self.client.cookies[settings.REPLICA_PIN_COOKIE] = '1'
+        response = self.client.get(reverse('product_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.aliases_read(response), {DEFAULT_DB_ALIAS})
+
+    def test_product_page_cache_is_filled_from_default(self):
+        response = self.client.get(reverse('product_detail', args=[self.product.pk]))
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertNotIn(REPLICA, self.aliases_read(response))
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_signed_in_product_page_reads_the_replica_once_fragments_are_cached(self):
+        self.client.force_login(self.user)
+        url = reverse('product_detail', args=[self.product.pk])
+
+        def replica_product_reads():
+            with CaptureQueriesContext(connections[REPLICA]) as replica_queries:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            return [query for query in replica_queries if 'FROM "apps_product"' in query['sql']]
+
+        # the first view fills the fragments, so the product comes from default
+        self.assertEqual(replica_product_reads(), [])
+        self.assertNotEqual(replica_product_reads(), [])
+
+    def test_category_tree_is_refilled_from_default(self):
+        bump_category_tree_version()
+        with read_from_replica(), CaptureQueriesContext(connections[REPLICA]) as replica_queries:
+            self.assertEqual([node.name for node in get_category_tree()], ['Phones'])
+        self.assertEqual(len(replica_queries), 0)
+
+
+class MetricsViewTests(TestCase):
+    def get_metrics(self, **headers):
+        return self.client.get(reverse('metrics'), headers=headers)
+
+    @override_settings(METRICS_TOKEN='scrape-token')
+    def test_metrics_need_the_token(self):
+        self.assertEqual(self.get_metrics().status_code, 404)
+        self.assertEqual(self.get_metrics(authorization='Bearer wrong').status_code, 404)
+        self.assertEqual(self.get_metrics(authorization='Bearer scrape-token').status_code, 200)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_metrics_are_off_without_a_token(self):
+        self.assertEqual(self.get_metrics(authorization='Bearer ').status_code, 404)
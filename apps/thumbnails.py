@@ -0,0 +1,57 @@
+import posixpath
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from apps.models import ProductImage
+
+THUMBNAIL_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+
+
+def variant_name(name, width, image_format):
+    # products/1-2.jpg -> thumbnails/products/1-2.360w.webp, the same name for the same upload every time
+    root, _ = posixpath.splitext(name)
+    return posixpath.join(settings.THUMBNAIL_DIR, f'{root}.{width}w.{image_format}')
+
+
+def variant_url(product_image, width, image_format='jpeg'):
+    return product_image.image.storage.url(variant_name(product_image.image.name, width, image_format))
+
+
+def variant_widths(source_width):
+    # the configured buckets, capped at the source: never upscale
+    return sorted({min(width, source_width) for width in settings.THUMBNAIL_WIDTHS})
+
+
+def encode_variant(source, width, image_format):
+    height = max(1, round(source.height * width / source.width))
+    variant = source.resize((width, height), Image.LANCZOS)
+    if image_format == 'jpeg' and variant.mode != 'RGB':
+        variant = variant.convert('RGB')
+    buffer = BytesIO()
+    variant.save(buffer, THUMBNAIL_FORMATS[image_format], quality=settings.THUMBNAIL_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+
+def make_variants(product_image, force=False):
+    field = product_image.image
+    storage = field.storage
+    with field.open('rb'), Image.open(field) as source:
+        source = ImageOps.exif_transpose(source)
+        if source.mode not in ('RGB', 'RGBA'):
+            source = source.convert('RGBA' if 'transparency' in source.info else 'RGB')
+        widths = variant_widths(source.width)
+        for width in widths:
+            for image_format in THUMBNAIL_FORMATS:
+                name = variant_name(field.name, width, image_format)
+                if force and storage.exists(name):
+                    storage.delete(name)
+                if not storage.exists(name):
+                    storage.save(name, ContentFile(encode_variant(source, width, image_format)))
+
+    # a queryset update: saving the instance would schedule the task again
+    ProductImage.objects.filter(pk=product_image.pk, image=field.name).update(thumbnail_widths=widths)
+    product_image.thumbnail_widths = widths
+    return widths
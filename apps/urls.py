@@ -1,13 +1,23 @@
+from django.conf import settings
 from django.urls import path
 
-from apps.views import ProductListView, ProductDetailView, RegisterCreateView, LogoutView, SettingsUpdateView, \
+from apps.views import AsyncProductListView, AsyncProductDetailView, AsyncFavouriteView, HeaderCountsView, \
+    ProductListView, ProductSearchView, CategoryProductListView, ProductDetailView, ProductReviewsView, RegisterCreateView, LogoutView, SettingsUpdateView, \
     CustomLoginView, CartRemoveView, CartDetailView, FavouriteView, AddToFavouriteView, \
     RemoveFromFavoritesView, update_quantity, CheckoutView, NewAddressCreateView, AddToCartView, AddressUpdateView, \
-    OrderDetailView, OrderCreateView, OrderListView, OrderDeleteView, OrderPdfCreateView
+    OrderDetailView, OrderCreateView, OrderListView, OrderDeleteView, OrderPdfCreateView, metrics_view
+
+# the ASGI deployment serves the hot read pages from their async variants
+product_list_view = AsyncProductListView if settings.ASYNC_VIEWS else ProductListView
+product_detail_view = AsyncProductDetailView if settings.ASYNC_VIEWS else ProductDetailView
+favourite_view = AsyncFavouriteView if settings.ASYNC_VIEWS else FavouriteView
 
 urlpatterns = [
-    path('', ProductListView.as_view(), name='product_list'),
-    path('product/<int:pk>', ProductDetailView.as_view(), name='product_detail'),
+    path('', product_list_view.as_view(), name='product_list'),
+    path('product/<int:pk>', product_detail_view.as_view(), name='product_detail'),
+    path('product/<int:pk>/reviews', ProductReviewsView.as_view(), name='product_reviews'),
+    path('search', ProductSearchView.as_view(), name='product_search'),
+    path('category/<slug:slug>', CategoryProductListView.as_view(), name='category_products'),
     path('settings', SettingsUpdateView.as_view(), name='settings_page'),
     path('register', RegisterCreateView.as_view(), name='register_page'),
     path('login', CustomLoginView.as_view(
@@ -21,11 +31,12 @@ urlpatterns = [
     path('add-address', NewAddressCreateView.as_view(), name='new_address'),
     path('edit-address<int:pk>/', AddressUpdateView.as_view(), name='edit_address'),
 
+    path('header-counts', HeaderCountsView.as_view(), name='header_counts'),
     path('cart/', CartDetailView.as_view(), name='cart_detail'),
     path('cart-add/<int:pk>/', AddToCartView.as_view(), name='cart_add'),
     path('cart-remove/<int:pk>/', CartRemoveView.as_view(), name='cart_remove'),
 
-    path('favorites/', FavouriteView.as_view(), name='favorites_page'),
+    path('favorites/', favourite_view.as_view(), name='favorites_page'),
     path('add-to-favourite/<int:pk>/', AddToFavouriteView.as_view(), name='addfavourites_page'),
     path('update-quantity/<int:pk>/', update_quantity, name='update_quantity'),
     path('remove-favorite/<int:pk>/', RemoveFromFavoritesView.as_view(), name='favorite_remove'),
@@ -34,6 +45,8 @@ urlpatterns = [
     path('order-create', OrderCreateView.as_view(), name='order_create'),
     path('orde/<int:pk>/', OrderDetailView.as_view(), name='order_detail'),
     path('orde/delete/<int:pk>/', OrderDeleteView.as_view(), name='order_delete'),
-    path('download-pdf/<int:pk>', OrderPdfCreateView.as_view(), name='download_pdf')
+    path('download-pdf/<int:pk>', OrderPdfCreateView.as_view(), name='download_pdf'),
+
+    path('metrics', metrics_view, name='metrics'),
 
 ]
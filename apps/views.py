@@ -1,35 +1,249 @@
+import logging
+from contextlib import ExitStack, nullcontext
+from hmac import compare_digest
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model, logout
+from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.contrib.auth.views import LoginView
-from django.db.models import Sum, F
-from django.http import JsonResponse, FileResponse
+from django.contrib.auth.views import LoginView, redirect_to_login
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.paginator import InvalidPage
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Count, OuterRef, Subquery, F, Value
+from django.db.models.functions import Coalesce
+from django.http import JsonResponse, FileResponse, Http404, HttpResponse
 from django.shortcuts import redirect, get_object_or_404
 from django.urls import reverse_lazy
 from django.views import View
 from django.views.generic import ListView, DetailView, CreateView, DeleteView, UpdateView
 
+from apps.cache import get_category_tree, get_category_subtree, invalidate_header_counts, get_product_page_version, \
+    product_page_key, record_cache_lookup, aget_header_counts, aget_category_tree, insert_category_sidebar
+from apps.cart import get_cart_summary, add_to_cart, set_cart_quantity, remove_from_cart
+from apps.db.router import read_from_default, read_from_replica
+from apps.facets import filter_products, parse_spec_filters, spec_facets, aspec_facets
 from apps.forms import UserRegisterModelForm, OrderCreateModelForm
-from apps.generate_pdf import make_pdf
-from apps.models import Product, Category, CartItem, Favorite, Address, Order, OrderItem
+from apps.generate_pdf import is_pdf_current, order_pdf_data, order_pdf_hash, store_pdf
+from apps.mail import queue_templated_email
+from apps.metrics import export_metrics
+from apps.models import Product, Category, CartItem, Favorite, Address, Order, Review
 from apps.models.user import SiteSettings
-from apps.tasks import send_to_email
+from apps.orders import checkout, CheckoutError
+from apps.pagination import KeysetPaginator
+from apps.search import search_products
+from apps.tasks import schedule_order_pdf
 
+logger = logging.getLogger(__name__)
 
-class CategoryMixin:
-    def get_context_data(self, *, object_list=None, **kwargs):
-        context = super().get_context_data(object_list=object_list, **kwargs)
-        context['categories'] = Category.objects.all()
-        return context
 
+def int_param(params, name):
+    try:
+        return int(params[name])
+    except (KeyError, ValueError):
+        return None
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryBudgetMixin:
+    max_queries = None
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.max_queries is None or self.view_is_async or not (settings.DEBUG or settings.QUERY_BUDGET_ENFORCE):
+            return super().dispatch(request, *args, **kwargs)
+
+        queries = []
+
+        def count_query(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
 
-class ProductListView(CategoryMixin, ListView):
-    queryset = Product.objects.order_by('-created_at')
+        with ExitStack() as stack:
+            for db in connections.all():
+                stack.enter_context(db.execute_wrapper(count_query))
+            response = super().dispatch(request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+
+        response['X-Query-Count'] = len(queries)
+        if len(queries) > self.max_queries:
+            message = f'{self.__class__.__name__} ran {len(queries)} queries, budget is {self.max_queries}'
+            if settings.QUERY_BUDGET_ENFORCE:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+
+class AsyncViewMixin:
+    # queries go through the async ORM; rendering the template (sidebar, header counts) is the one sync hop left
+    async def get_user(self):
+        # resolved once: the lazy request.user would look the session user up again inside the render
+        self.request.user = await self.request.auser()
+        return self.request.user
+
+    async def render_async(self, context):
+        return await sync_to_async(self.render_to_response(context).render)()
+
+
+class ReplicaReadMixin:
+    # read-only pages read from a replica, unless the client wrote in the last REPLICA_PIN_SECONDS
+    def use_replica(self):
+        return not getattr(self.request, 'db_pinned', False)
+
+    def dispatch(self, request, *args, **kwargs):
+        if not self.use_replica():
+            return super().dispatch(request, *args, **kwargs)
+        if self.view_is_async:
+            return self.dispatch_on_replica(request, *args, **kwargs)
+        with read_from_replica():
+            response = super().dispatch(request, *args, **kwargs)
+            # the template evaluates the lazy querysets, so it has to render on the replica too
+            if hasattr(response, 'render'):
+                response.render()
+        return response
+
+    async def dispatch_on_replica(self, request, *args, **kwargs):
+        with read_from_replica():
+            return await super().dispatch(request, *args, **kwargs)
+
+
+class ProductListView(ReplicaReadMixin, QueryBudgetMixin, ListView):
+    # a correlated count keeps the outer query ungrouped, so the sort can walk an index and stop at the page
+    queryset = Product.objects.select_related('category').prefetch_related('images').annotate(
+        favourite_count=Coalesce(Subquery(Favorite.objects.filter(product=OuterRef('pk')).order_by().values(
+            'product').annotate(count=Count('pk')).values('count')), 0)).order_by('-created_at')
     template_name = 'apps/product/product_list.html'
     paginate_by = 2
     context_object_name = "products"
+    max_queries = 9
+
+    sortings = {
+        '-created_at': ('-created_at', '-id'),
+        'price': ('effective_price', 'id'),
+        '-price': ('-effective_price', '-id'),
+        'rating': ('-rating_average', '-rating_count', '-id'),
+    }
+
+    def get_ordering(self):
+        return self.sortings.get(self.request.GET.get('sorting'), self.sortings['-created_at'])
+
+    def get_category_tree(self):
+        return get_category_tree()
+
+    def get_category(self):
+        slug = self.request.GET.get('category')
+        return get_category_subtree(slug, self.get_category_tree()) if slug else (None, [])
+
+    def get_queryset(self):
+        params = self.request.GET
+        self.category, self.category_ids = self.get_category()
+        self.price_min, self.price_max = int_param(params, 'price_min'), int_param(params, 'price_max')
+        self.spec_filters = parse_spec_filters(params)
+        return filter_products(super().get_queryset(), self.category, self.price_min, self.price_max,
+                               self.spec_filters)
+
+    def liked_products_query(self, products):
+        return Favorite.objects.filter(user=self.request.user, product_id__in=[product.pk for product in products]
+                                       ).values_list('product_id', flat=True)
+
+    def get_liked_products(self, products):
+        return set(self.liked_products_query(products)) if self.request.user.is_authenticated else set()
+
+    def get_spec_facets(self):
+        return spec_facets(self.category_ids if self.category else None)
+
+    def get_context_data(self, *, object_list=None, **kwargs):
+        context = super().get_context_data(object_list=object_list, **kwargs)
+        context['liked_products'] = self.get_liked_products(context['products'])
+
+        parent_id = self.category.pk if self.category else None
+        context['current_category'] = self.category
+        context['subcategories'] = [node for node in self.get_category_tree() if node.parent_id == parent_id]
+        context['price_min'], context['price_max'] = self.price_min, self.price_max
+        context['sorting'] = self.request.GET.get('sorting', '-created_at')
+        context['spec_facets'] = [
+            (key, [(value, count, value in self.spec_filters.get(key, ())) for value, count in values])
+            for key, values in self.get_spec_facets().items()
+        ]
+        return context
+
+
+class AsyncProductListView(AsyncViewMixin, ProductListView):
+    async def get(self, request, *args, **kwargs):
+        user = await self.get_user()
+        self.category_tree = await aget_category_tree()
+        self.object_list = self.get_queryset()
+        paginator = self.get_paginator(self.object_list, self.get_paginate_by(self.object_list))
+        # set before get_page() so validating the page number needs no sync count()
+        paginator.count = await self.object_list.acount()
+        number = self.kwargs.get(self.page_kwarg) or request.GET.get(self.page_kwarg) or 1
+        try:
+            page = paginator.page(paginator.num_pages if number == 'last' else number)
+        except InvalidPage:
+            raise Http404('Invalid page')
+        page.object_list = [product async for product in page.object_list]
+
+        self.page = paginator, page, page.object_list, page.has_other_pages()
+        self.liked_products = {product_id async for product_id in self.liked_products_query(page.object_list)} \
+            if user.is_authenticated else set()
+        self.spec_facets = await aspec_facets(self.category_ids if self.category else None)
+        return await self.render_async(self.get_context_data())
+
+    def get_category_tree(self):
+        return self.category_tree
+
+    def paginate_queryset(self, queryset, page_size):
+        return self.page
+
+    def get_liked_products(self, products):
+        return self.liked_products
+
+    def get_spec_facets(self):
+        return self.spec_facets
+
+
+class ProductSearchView(ProductListView):
+    paginate_by = 20
+
+    def get_queryset(self):
+        self.query = self.request.GET.get('q', '').strip()
+        self.fuzzy = False
+        if not self.query:
+            return super().get_queryset().none()
+        queryset, self.fuzzy = search_products(super().get_queryset(), self.query)
+        if self.request.GET.get('sorting') in self.sortings:
+            queryset = queryset.order_by(*self.get_ordering())
+        return queryset
+
+    def get_context_data(self, *, object_list=None, **kwargs):
+        context = super().get_context_data(object_list=object_list, **kwargs)
+        context['query'] = self.query
+        context['fuzzy'] = self.fuzzy
+        return context
 
 
-class ProductDetailView(CategoryMixin, DetailView):
+class CategoryProductListView(ProductListView):
+    template_name = 'apps/product/category_products.html'
+    paginate_by = 20
+
+    def get_category(self):
+        category, category_ids = get_category_subtree(self.kwargs['slug'], self.get_category_tree())
+        if category is None:
+            raise Http404('No such category')
+        return category, category_ids
+
+    def paginate_queryset(self, queryset, page_size):
+        page = KeysetPaginator(queryset, self.get_ordering(), page_size).page(
+            after=self.request.GET.get('after'), before=self.request.GET.get('before'))
+        return None, page, page.object_list, page.has_other_pages()
+
+
+class ProductDetailView(ReplicaReadMixin, DetailView):
     template_name = 'apps/product/product_details.html'
     context_object_name = 'product'
 
@@ -38,9 +252,124 @@ class ProductDetailView(CategoryMixin, DetailView):
     #     context['products'] = Product.objects.all()
     #     return context
 
+    # the {% cached_fragment %} blocks of the template, keyed on the product and the page version
+    cached_fragments = 'product_summary', 'product_details'
+    fill_fragments = True
+
     def get_queryset(self):
+        # a fragment that misses is stored under the current version, so it must not be rendered from a
+        # replica row behind that version; once every fragment is cached the product is read from the replica
+        if self.fill_fragments:
+            return Product.objects.using(DEFAULT_DB_ALIAS)
         return Product.objects.all()
 
+    def fragment_keys(self):
+        return [make_template_fragment_key(name, [self.kwargs['pk'], self.cache_version])
+                for name in self.cached_fragments]
+
+    def get(self, request, *args, **kwargs):
+        self.cache_version = get_product_page_version(self.kwargs['pk'])
+        if not self.is_shared_page():
+            self.fill_fragments = len(cache.get_many(self.fragment_keys())) < len(self.cached_fragments)
+            return super().get(request, *args, **kwargs)
+
+        key = product_page_key(self.kwargs['pk'], self.cache_version)
+        content = cache.get(key)
+        record_cache_lookup('product_page', content is not None)
+        if content is not None:
+            return self.cached_response(content)
+
+        with read_from_default():
+            response = super().get(request, *args, **kwargs).render()
+        if response.status_code == 200:
+            cache.set(key, response.content, settings.PRODUCT_PAGE_CACHE_TIMEOUT)
+        response.content = insert_category_sidebar(response.content)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def is_shared_page(self):
+        # anonymous pages carry nothing per user, so the whole response is shared;
+        # signed-in users get the cached fragments around their own cart and like buttons
+        return not self.request.user.is_authenticated and not self.request.GET
+
+    def cached_response(self, content):
+        response = HttpResponse(insert_category_sidebar(content))
+        response['X-Cache'] = 'HIT'
+        return response
+
+    def favourites_query(self):
+        return Favorite.objects.filter(product_id=self.object.pk)
+
+    def get_user_state(self):
+        user = self.request.user
+        return {
+            'liked': user.is_authenticated and self.favourites_query().filter(user=user).exists(),
+            'favourite_count': self.favourites_query().count(),
+        }
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['cache_version'] = self.cache_version
+        context['defer_category_sidebar'] = self.is_shared_page()
+        context.update(self.get_user_state())
+        return context
+
+
+class AsyncProductDetailView(AsyncViewMixin, ProductDetailView):
+    async def get(self, request, *args, **kwargs):
+        await self.get_user()
+        self.cache_version = await sync_to_async(get_product_page_version)(self.kwargs['pk'])
+        key = product_page_key(self.kwargs['pk'], self.cache_version)
+        if self.is_shared_page():
+            content = await cache.aget(key)
+            await sync_to_async(record_cache_lookup)('product_page', content is not None)
+            if content is not None:
+                return await sync_to_async(self.cached_response)(content)
+        else:
+            self.fill_fragments = len(await cache.aget_many(self.fragment_keys())) < len(self.cached_fragments)
+
+        with read_from_default() if self.is_shared_page() else nullcontext():
+            try:
+                self.object = await self.get_queryset().select_related('category').aget(pk=self.kwargs['pk'])
+            except Product.DoesNotExist:
+                raise Http404('No such product')
+            user = request.user
+            self.user_state = {
+                'liked': user.is_authenticated and await self.favourites_query().filter(user=user).aexists(),
+                'favourite_count': await self.favourites_query().acount(),
+            }
+            response = await self.render_async(self.get_context_data(object=self.object))
+
+        if self.is_shared_page():
+            await cache.aset(key, response.content, settings.PRODUCT_PAGE_CACHE_TIMEOUT)
+            response.content = await sync_to_async(insert_category_sidebar)(response.content)
+            response['X-Cache'] = 'MISS'
+        return response
+
+    def get_user_state(self):
+        return self.user_state
+
+
+class ProductReviewsView(ReplicaReadMixin, View):
+    orderings = {
+        'newest': ('-id',),
+        'highest': ('-rating', '-id'),
+        'lowest': ('rating', 'id'),
+    }
+    per_page = 10
+
+    def get(self, request, pk, *args, **kwargs):
+        ordering = self.orderings.get(request.GET.get('sorting'), self.orderings['newest'])
+        reviews = Review.objects.filter(product_id=pk).only('name', 'rating', 'review_text', 'date_posted')
+        page = KeysetPaginator(reviews, ordering, self.per_page).page(request.GET.get('after'),
+                                                                      request.GET.get('before'))
+        return JsonResponse({
+            'reviews': [{'id': review.pk, 'name': review.name, 'rating': review.rating, 'text': review.review_text,
+                         'date_posted': review.date_posted.isoformat()} for review in page],
+            'next': page.next_cursor,
+            'previous': page.previous_cursor,
+        })
+
 
 class RegisterCreateView(CreateView):
     template_name = 'apps/auth/register.html'
@@ -48,15 +377,15 @@ class RegisterCreateView(CreateView):
     success_url = reverse_lazy('product_list')
 
     def form_valid(self, form):
-        form.save()
-        send_to_email.delay('Your account has been created!', form.data['email'])
+        user = form.save()
+        queue_templated_email(user.email, 'account_created', {'user': user})
         return super().form_valid(form)
 
     def form_invalid(self, form):
         return super().form_invalid(form)
 
 
-class SettingsUpdateView(CategoryMixin, LoginRequiredMixin, UpdateView):
+class SettingsUpdateView(LoginRequiredMixin, UpdateView):
     model = get_user_model()
     queryset = model.objects.all()
     fields = 'first_name', 'last_name'
@@ -80,63 +409,83 @@ class LogoutView(View):
         return redirect('product_list')
 
 
-class CartDetailView(CategoryMixin, LoginRequiredMixin, ListView):
+class CartDetailView(LoginRequiredMixin, ListView):
     template_name = 'apps/shopping/shopping-cart.html'
     context_object_name = 'cart_view'
     success_url = reverse_lazy('shopping-cart_detail')
 
     def get_queryset(self):
-        return CartItem.objects.filter(product__cartitem__user=self.request.user)
+        return CartItem.objects.filter(user=self.request.user).select_related('product')
 
     def get_context_data(self, *, object_list=None, **kwargs):
         ctx = super().get_context_data(object_list=object_list, **kwargs)
-        qs = self.get_queryset()
-
-        ctx.update(
-            **qs.aggregate(
-                total_sum=Sum(F('quantity') * F('product__price') * (100 - F('product__discount')) / 100),
-                total_count=Sum(F('quantity'))
-            )
-        )
+        summary = get_cart_summary(self.request.user)
+        ctx['total_sum'] = summary.subtotal
+        ctx['total_count'] = summary.item_count
         return ctx
 
 
 # @method_decorator(require_POST, name='dispatch')
-class AddToCartView(CategoryMixin, View):
+class AddToCartView(LoginRequiredMixin, View):
     def get(self, request, pk, *args, **kwargs):
         product = get_object_or_404(Product, id=pk)
-        cart_item, created = CartItem.objects.get_or_create(user=request.user, product=product)
-
-        if not created:
-            cart_item.quantity += 1
-            cart_item.save()
-
+        if add_to_cart(request.user.pk, product) == 1:
+            invalidate_header_counts(request.user.pk)
         return redirect('cart_detail')
 
 
-class CartRemoveView(CategoryMixin, DeleteView):
+class CartRemoveView(LoginRequiredMixin, DeleteView):
     model = CartItem
     success_url = reverse_lazy('cart_detail')
 
+    def get_queryset(self):
+        return CartItem.objects.filter(user=self.request.user).select_related('product')
+
+    def form_valid(self, form):
+        remove_from_cart(self.request.user.pk, self.object.pk)
+        invalidate_header_counts(self.request.user.pk)
+        return redirect(self.get_success_url())
 
 
-class FavouriteView(CategoryMixin, ListView):
-    queryset = Favorite.objects.all()
+
+class BaseFavouriteView(ReplicaReadMixin, ListView):
+    # the same rows under WSGI and ASGI, only the login check differs
     template_name = 'apps/shopping/favourite_cart.html'
     context_object_name = 'favourites'
 
-
     def get_queryset(self):
-        return Favorite.objects.filter(product__favorite__user=self.request.user)
+        return Favorite.objects.filter(user=self.request.user).select_related('product').prefetch_related(
+            'product__images').order_by('-created_at')
 
 
+class FavouriteView(LoginRequiredMixin, BaseFavouriteView):
+    pass
 
 
-class AddToFavouriteView(LoginRequiredMixin, CategoryMixin, View):
+class AsyncFavouriteView(AsyncViewMixin, BaseFavouriteView):
+    # LoginRequiredMixin.dispatch reads the lazy request.user, which the event loop must not do
+    async def get(self, request, *args, **kwargs):
+        user = await self.get_user()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        self.object_list = [favourite async for favourite in self.get_queryset()]
+        return await self.render_async(self.get_context_data())
+
+
+class HeaderCountsView(View):
+    async def get(self, request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return JsonResponse({'cart_count': 0, 'favourite_count': 0})
+        return JsonResponse(await aget_header_counts(user.pk))
+
+
+class AddToFavouriteView(LoginRequiredMixin, View):
     def get(self, request, pk, *args, **kwargs):
         obj, created = Favorite.objects.get_or_create(user=request.user, product_id=pk)
         if not created:
             obj.delete()
+        invalidate_header_counts(request.user.pk)
         referer = request.META.get('HTTP_REFERER')
         if referer:
             return redirect(referer)
@@ -144,56 +493,63 @@ class AddToFavouriteView(LoginRequiredMixin, CategoryMixin, View):
             return redirect('product_detail', pk=pk)
 
 
+def metrics_view(request):
+    # a token, not the client address: behind a reverse proxy every request comes from 127.0.0.1
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not settings.METRICS_TOKEN or not compare_digest(token.encode(), settings.METRICS_TOKEN.encode()):
+        raise Http404
+    content, content_type = export_metrics()
+    return HttpResponse(content, content_type=content_type)
+
+
+@login_required
 def update_quantity(request, pk):
     if request.method == 'POST':
-        product = get_object_or_404(CartItem, pk=pk)
         new_quantity = int(request.POST.get('quantity', 1))
         if new_quantity > 0:
-            product.quantity = new_quantity
-            product.save()
-
-            total_sum = CartItem.objects.aggregate(
-                total_sum=Sum(F('quantity') * F('product__price') * (100 - F('product__discount')) / 100)
-            )['total_sum'] or 0
-
-            total_count = CartItem.objects.aggregate(
-                total_count=Sum('quantity')
-            )['total_count'] or 0
-
-            return JsonResponse({'new_quantity': new_quantity, 'total_sum': total_sum, 'total_count': total_count})
+            try:
+                set_cart_quantity(request.user.pk, pk, new_quantity)
+            except CartItem.DoesNotExist:
+                raise Http404('No such cart item')
+
+            summary = get_cart_summary(request.user)
+            return JsonResponse({'new_quantity': new_quantity, 'total_sum': summary.subtotal,
+                                 'total_count': summary.item_count})
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
 
-class RemoveFromFavoritesView(CategoryMixin, DeleteView):
+class RemoveFromFavoritesView(LoginRequiredMixin, DeleteView):
     model = Favorite
     success_url = reverse_lazy('favorites_page')
 
+    def get_queryset(self):
+        return Favorite.objects.filter(user=self.request.user)
+
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        invalidate_header_counts(self.request.user.pk)
+        return response
+
 
-class CheckoutView(LoginRequiredMixin, CategoryMixin, ListView):
+class CheckoutView(LoginRequiredMixin, ListView):
     template_name = "apps/shopping/checkout.html"
     model = CartItem
     context_object_name = 'cart_items'
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data(object_list=object_list, **kwargs)
-        qs = self.get_queryset()
-
-        context.update(
-            **qs.aggregate(
-                sub_total=Sum(F('quantity') * F('product__price') * (100 - F('product__discount')) / 100),
-                shipping_cost=Sum(F('product__shipping_cost')),
-                all_total=Sum((F('quantity') * F('product__price') * (100 - F('product__discount')) / 100) + F(
-                    'product__shipping_cost'))
-            )
-        )
+        summary = get_cart_summary(self.request.user)
+        context['sub_total'] = summary.subtotal
+        context['shipping_cost'] = summary.shipping
+        context['all_total'] = summary.total
         context['addresses'] = Address.objects.filter(user=self.request.user)
         return context
 
-    # def get_queryset(self):
-    #     return super().get_queryset().filter(user=self.request.user)
+    def get_queryset(self):
+        return super().get_queryset().filter(user=self.request.user).select_related('product')
 
 
-class NewAddressCreateView(CategoryMixin, CreateView):
+class NewAddressCreateView(CreateView):
     template_name = "apps/address/new_address.html"
     model = Address
     fields = 'city', 'street', 'zip_code', 'phone', 'full_name'
@@ -205,30 +561,47 @@ class NewAddressCreateView(CategoryMixin, CreateView):
         return super().form_valid(form)
 
 
-class AddressUpdateView(CategoryMixin, UpdateView):
+class AddressUpdateView(UpdateView):
     model = Address
     template_name = 'apps/address/edit.html'
     fields = 'city', 'street', 'phone', 'zip_code'
     success_url = reverse_lazy('checkout_page')
 
 
-class OrderListView(CategoryMixin, ListView):
+class OrderListView(ReplicaReadMixin, ListView):
     model = Order
     template_name = 'apps/orders/order_list.html'
     context_object_name = 'orders'
     paginate_by = 10
+    ordering = '-created_at', '-id'
+
+    def use_replica(self):
+        # customers read their own orders right after checkout; staff reports can lag
+        return self.request.user.is_staff and super().use_replica()
 
     def get_queryset(self):
+        # the invoice adds the site tax on top of the stored total, the list shows the same amount
+        tax = SiteSettings.objects.values_list('tax', flat=True).first() or 0
+        queryset = super().get_queryset().select_related('address', 'owner').alias(
+            tax_amount=F('total') * Value(tax) / 100).annotate(grand_total=F('total') + F('tax_amount'))
         if self.request.user.is_staff or self.request.user.is_superuser:
-            return super().get_queryset()
-        return super().get_queryset().filter(owner=self.request.user)
+            return queryset
+        return queryset.filter(owner=self.request.user)
 
+    def paginate_queryset(self, queryset, page_size):
+        page = KeysetPaginator(queryset, self.get_ordering(), page_size).page(
+            after=self.request.GET.get('after'), before=self.request.GET.get('before'))
+        return None, page, page.object_list, page.has_other_pages()
 
-class OrderDetailView(CategoryMixin, DetailView):
+
+class OrderDetailView(ReplicaReadMixin, DetailView):
     model = Order
     template_name = 'apps/orders/order_detail.html'
     context_object_name = 'order'
 
+    def use_replica(self):
+        return self.request.user.is_staff and super().use_replica()
+
     def get_queryset(self):
         if self.request.user.is_staff or self.request.user.is_superuser:
             return super().get_queryset()
@@ -237,15 +610,8 @@ class OrderDetailView(CategoryMixin, DetailView):
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data(object_list=object_list, **kwargs)
-        qs = OrderItem.objects.filter(order_id=context['order'].id)
-
-        context.update(
-            **qs.aggregate(
-                subtotal=Sum(F('quantity') * (F('product__price') * (
-                        100 - F('product__discount')) / 100)),
-                shipping_cost=Sum(F('product__shipping_cost'))
-            )
-        )
+        context['subtotal'] = self.object.subtotal
+        context['shipping_cost'] = self.object.shipping_cost
         context['tax'] = SiteSettings.objects.first().tax
         return context
 
@@ -254,7 +620,7 @@ class OrderDeleteView(DeleteView):
     success_url = reverse_lazy('order_list')
 
 
-class OrderCreateView(LoginRequiredMixin, CategoryMixin, CreateView):
+class OrderCreateView(LoginRequiredMixin, CreateView):
     model = Order
     template_name = 'apps/shopping/checkout.html'
     form_class = OrderCreateModelForm
@@ -262,13 +628,36 @@ class OrderCreateView(LoginRequiredMixin, CategoryMixin, CreateView):
 
     def form_valid(self, form):
         form.instance.owner = self.request.user
-        return super().form_valid(form)
-
-
-class OrderPdfCreateView(View):
+        try:
+            with transaction.atomic():
+                self.object = form.save()
+                checkout(self.object)
+        except CheckoutError as e:
+            form.add_error(None, str(e))
+            return self.form_invalid(form)
+        invalidate_header_counts(self.request.user.pk)
+        return redirect(self.get_success_url())
+
+
+class OrderPdfCreateView(LoginRequiredMixin, View):
     def get(self, request, pk, *args, **kwargs):
-        order = get_object_or_404(Order, pk=pk)
-        if not order.pdf_file:
-            make_pdf(order)
-        # return FileResponse(order.pdf_file.open(), as_attachment=True)
-        return FileResponse(order.pdf_file, as_attachment=True)
+        orders = Order.objects.all()
+        if not (request.user.is_staff or request.user.is_superuser):
+            orders = orders.filter(owner=request.user)
+        order = get_object_or_404(orders, pk=pk)
+
+        lines, tax = order_pdf_data(order)
+        pdf_hash = order_pdf_hash(lines, tax)
+        filename = f'order_{order.pk}.pdf'
+        if is_pdf_current(order, pdf_hash):
+            return FileResponse(order.pdf_file.open('rb'), as_attachment=True, filename=filename)
+
+        if len(lines) <= settings.ORDER_PDF_INLINE_MAX_LINES:
+            # small invoices are rendered right here, into the same hash-keyed file the task would write
+            pdf_file = store_pdf(order, lines, tax, pdf_hash)
+            return FileResponse(pdf_file.open('rb'), as_attachment=True, filename=filename)
+
+        schedule_order_pdf(order.pk, pdf_hash)
+        response = JsonResponse({'status': 'rendering', 'poll_url': request.build_absolute_uri()}, status=202)
+        response['Retry-After'] = 2
+        return response